@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Compare the serialization policies of IDMLPackage (see its `pretty_print', `xml_declaration'
+and `remove_blank_text' options): throughput of IDMLXMLFile.tostring() and size of the XML files.
+"""
+
+import argparse
+import glob
+import os
+import time
+from simple_idml.components import get_idml_xml_file_by_name
+from simple_idml.idml import IDMLPackage
+
+POLICIES = (
+    ("pretty (default)", {}),
+    ("compact", {"pretty_print": False}),
+    ("compact, no blank text", {"pretty_print": False, "remove_blank_text": True}),
+    ("compact, no blank text, no declaration", {"pretty_print": False, "remove_blank_text": True,
+                                                "xml_declaration": False}),
+)
+
+
+def get_xml_files(idml_package):
+    return [get_idml_xml_file_by_name(idml_package, name) for name in idml_package.namelist()
+            if os.path.splitext(name)[1] == ".xml" and os.path.basename(name) not in ("container.xml", "metadata.xml")]
+
+
+def bench(filename, options, repeat):
+    with IDMLPackage(filename, **options) as idml_package:
+        xml_files = get_xml_files(idml_package)
+        for xml_file in xml_files:
+            xml_file.dom  # pylint: disable=pointless-statement
+        size = 0
+        start = time.perf_counter()
+        for _ in range(repeat):
+            size = sum(len(xml_file.tostring()) for xml_file in xml_files)
+        elapsed = time.perf_counter() - start
+    return size, elapsed
+
+
+def main():
+    default_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "test")
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('files', metavar='IDML', nargs='*', help="IDML files (default: the test documents)")
+    parser.add_argument('--repeat', type=int, default=20, help="Serializations of each document (default: 20)")
+    args = parser.parse_args()
+
+    files = args.files or sorted(glob.glob(os.path.join(default_dir, "*.idml")))
+    for filename in files:
+        print(os.path.basename(filename))
+        reference_size = None
+        for label, options in POLICIES:
+            size, elapsed = bench(filename, options, args.repeat)
+            reference_size = reference_size or size
+            print(f"  {label:<40} {size:>10} bytes ({size / reference_size:6.1%})"
+                  f" {size * args.repeat / elapsed / 2 ** 20:8.1f} MB/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Compare the compiled XPath expressions of simple_idml.xpaths with the same queries evaluated
+from a string with etree.Element.xpath(), on the XMLElement nodes of the stories of a document.
+"""
+
+import argparse
+import os
+import time
+from simple_idml.components import Story
+from simple_idml.idml import IDMLPackage
+from simple_idml.xpaths import (CHARACTER_STYLE_RANGES, LOCAL_CHARACTER_STYLE_RANGES, CONTENT_NODES,
+                                CONTENT_AND_XMLELEMENT_NODES, XMLATTRIBUTES, XMLATTRIBUTE_BY_NAME)
+
+QUERIES = (
+    ("character style ranges", CHARACTER_STYLE_RANGES, {}),
+    ("local character style ranges", LOCAL_CHARACTER_STYLE_RANGES, {}),
+    ("content nodes", CONTENT_NODES, {}),
+    ("content and XMLElement nodes", CONTENT_AND_XMLELEMENT_NODES, {}),
+    ("XMLAttribute nodes", XMLATTRIBUTES, {}),
+    ("XMLAttribute by name", XMLATTRIBUTE_BY_NAME, {"name": "href"}),
+)
+
+
+def get_xml_elements(idml_package):
+    return [element for story in idml_package.stories
+            for element in Story(idml_package, story).dom.iter("XMLElement")]
+
+
+def bench_string(elements, xpath, variables, repeat):
+    # The parameterised queries were built with an f-string on each call.
+    path = xpath.path
+    for name, value in variables.items():
+        path = path.replace(f"${name}", f"'{value}'")
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for element in elements:
+            element.xpath(path)
+    return time.perf_counter() - start
+
+
+def bench_compiled(elements, xpath, variables, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for element in elements:
+            xpath(element, **variables)
+    return time.perf_counter() - start
+
+
+def main():
+    default_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "test", "12page.idml")
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('files', metavar='IDML', nargs='*', help="IDML files (default: the 12-page test document)")
+    parser.add_argument('--repeat', type=int, default=200, help="Queries on each XMLElement (default: 200)")
+    args = parser.parse_args()
+
+    for filename in args.files or [default_file]:
+        with IDMLPackage(filename) as idml_package:
+            elements = get_xml_elements(idml_package)
+            print(f"{os.path.basename(filename)}: {len(elements)} XMLElement nodes")
+            for label, xpath, variables in QUERIES:
+                string_elapsed = bench_string(elements, xpath, variables, args.repeat)
+                compiled_elapsed = bench_compiled(elements, xpath, variables, args.repeat)
+                print(f"  {label:<32} string {string_elapsed:8.3f}s  compiled {compiled_elapsed:8.3f}s"
+                      f"  x{string_elapsed / compiled_elapsed:5.1f}")
+
+
+if __name__ == "__main__":
+    main()
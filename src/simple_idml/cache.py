@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+import copy
+import hashlib
+import json
+import os
+import zipfile
+from tempfile import NamedTemporaryFile
+
+
+class PackageCache():
+    """Lazy attributes of an IDMLPackage stored in a JSON file of a cache directory.
+
+    The file is named after the content of the archive (see get_archive_key()): a package
+    reopened or a copy of the same document finds the values computed before.
+    The values must be JSON serializable. Entries are never removed from the directory. """
+
+    def __init__(self, directory, key):
+        self.directory = directory
+        self.key = key
+        self.path = os.path.join(directory, f"{key}.json")
+        self._entry = None
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} object {self.path} at {hex(id(self))}>"
+
+    @property
+    def entry(self):
+        if self._entry is None:
+            try:
+                with open(self.path, encoding="utf-8") as fobj:
+                    entry = json.load(fobj)
+            except (OSError, ValueError):
+                entry = None
+            # A corrupt file is rewritten by the next set().
+            self._entry = entry if isinstance(entry, dict) else {}
+        return self._entry
+
+    def get(self, name):
+        """A copy of the value `name', None if it is not cached. """
+        return copy.deepcopy(self.entry.get(name))
+
+    def set(self, name, value):
+        self.entry[name] = copy.deepcopy(value)
+        os.makedirs(self.directory, exist_ok=True)
+        # Readers never see a partial file.
+        with NamedTemporaryFile(mode="w", encoding="utf-8", dir=self.directory,
+                                suffix=".json", delete=False) as tmp_file:
+            json.dump(self.entry, tmp_file)
+        os.replace(tmp_file.name, self.path)
+
+
+def get_archive_key(zip_file):
+    """A hash of the content of the ZipFile: the names, sizes and CRC of its members. """
+    digest = hashlib.sha1()
+    for info in zipfile.ZipFile.infolist(zip_file):
+        digest.update(f"{info.filename}\0{info.file_size}\0{info.CRC}\n".encode("utf-8"))
+    return digest.hexdigest()
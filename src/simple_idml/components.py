@@ -7,8 +7,13 @@ import re
 from decimal import Decimal
 from lxml import etree
 from simple_idml import IdPkgNS, BACKINGSTORY
-from simple_idml.utils import increment_xmltag_id, prefix_content_filename, deepcopy_element_as
+from simple_idml.utils import increment_xmltag_id, prefix_content_filename, deepcopy_element_as, strip_blank_text
 from simple_idml.utils import Proxy
+from simple_idml.xpaths import (CHARACTER_STYLE_RANGES, LOCAL_CHARACTER_STYLE_RANGES, CONTENT_NODES,
+                                CONTENT_AND_XMLELEMENT_NODES, XMLATTRIBUTES, XMLATTRIBUTE_BY_NAME,
+                                PATH_POINTS, ITEMS_ON_LAYER, GUIDES_ON_LAYER, LAYER_BY_NAME, LAYER_BY_ID,
+                                CHARACTER_STYLE_BY_ID)
+from simple_idml.working_copy import StoredMember
 
 RECTO = "recto"
 VERSO = "verso"
@@ -16,10 +21,103 @@ VERSO = "verso"
 rx_node_name_from_xml_name = re.compile(r"[\w]+/[\w]+_([\w]+)\.xml")
 
 
+class ElementIndex():
+    """The elements of a tree by value of some of their attributes.
+
+    It is built on the first lookup. The methods modifying the tree keep it up to date with
+    add(), remove() and set(), or drop it with invalidate() when they change the whole tree.
+    A returned element is checked (still in the tree with that value) and the index is rebuilt
+    if it is not, but an element added without add() is not found. """
+
+    def __init__(self, root, attrs):
+        self.root = root
+        self.attrs = attrs
+        self._elements = None
+        # (attr, value) keys whose elements may not be in document order anymore.
+        self._unordered = set()
+
+    def invalidate(self):
+        self._elements = None
+        self._unordered = set()
+
+    def get(self, attr, value, tag="*"):
+        """The first element `tag' (in document order) having attr=value, or None. """
+        if self._elements is None:
+            self._build()
+        if (attr, value) in self._unordered:
+            self._elements[attr][value] = self.root.xpath(f"//*[@{attr}=$value]", value=value)
+            self._unordered.discard((attr, value))
+        for elt in self._elements[attr].get(value, ()):
+            if tag == "*" or elt.tag == tag:
+                if self._is_current(elt, attr, value):
+                    return elt
+                # The tree has been modified behind the index.
+                self._build()
+                return self.get(attr, value, tag)
+        return None
+
+    def add(self, element):
+        """Index element and its descendants, newly inserted in the tree. """
+        if self._elements is None:
+            return
+        for elt in element.iter(etree.Element):
+            for attr in self.attrs:
+                value = elt.get(attr)
+                if value is not None:
+                    elements = self._elements[attr].setdefault(value, [])
+                    if elements:
+                        self._unordered.add((attr, value))
+                    elements.append(elt)
+
+    def remove(self, element):
+        """Unindex element and its descendants, removed from the tree. """
+        if self._elements is None:
+            return
+        for elt in element.iter(etree.Element):
+            for attr in self.attrs:
+                elements = self._elements[attr].get(elt.get(attr), ())
+                if elt in elements:
+                    elements.remove(elt)
+
+    def set(self, element, attr, value):
+        """Set (or delete if value is None) the attribute of an element of the tree. """
+        if self._elements is not None and attr in self._elements:
+            elements = self._elements[attr].get(element.get(attr), ())
+            if element in elements:
+                elements.remove(element)
+            if value is not None:
+                elements = self._elements[attr].setdefault(value, [])
+                if elements:
+                    self._unordered.add((attr, value))
+                elements.append(element)
+        if value is None:
+            element.attrib.pop(attr, None)
+        else:
+            element.set(attr, value)
+
+    def _build(self):
+        self._unordered = set()
+        self._elements = {}
+        for attr in self.attrs:
+            elements = self._elements[attr] = {}
+            for elt in self.root.xpath(f"//*[@{attr}]"):
+                elements.setdefault(elt.get(attr), []).append(elt)
+
+    def _is_current(self, elt, attr, value):
+        if elt.get(attr) != value:
+            return False
+        top = elt
+        for top in elt.iterancestors():
+            pass
+        return top is self.root
+
+
 class IDMLXMLFile():
     """Abstract class for various XML files found in IDML Packages. """
     name = None
     doctype = None
+    # The attributes indexed for get_element_by_id().
+    indexed_attrs = ("Self", "ParentStory", "XMLContent", "MarkupTag")
     excluded_tags_for_prefix = (
         "Document",
         "Language",
@@ -61,6 +159,7 @@ class IDMLXMLFile():
         self.working_copy_path = working_copy_path
         self._fobj = None
         self._dom = None
+        self._index = None
 
     def __repr__(self):
         return f"<{self.__class__.__name__} object {self.name} at {hex(id(self))}>"
@@ -69,40 +168,55 @@ class IDMLXMLFile():
     def fobj(self):
         if self._fobj is None:
             if self.working_copy_path:
-                filename = os.path.join(self.working_copy_path, self.name)
-                fobj = open(filename, mode="rb+")
+                fobj = self.idml_package.working_copy.open(self.name)
             else:
-                fobj = self.idml_package.open(self.name, mode="r")
+                fobj = self.idml_package.open_member(self.name)
             self._fobj = fobj
         return self._fobj
 
+    @property
+    def shared(self):
+        """True if the file reads from the same source (archive or working copy) as its package:
+        its tree and index are shared with the other instances of the same part. """
+        return self.working_copy_path == self.idml_package.working_copy_path
+
     @property
     def dom(self):
         if self._dom is None:
-            xml = self.fobj.read()
-            try:
-                dom = etree.fromstring(xml, parser=etree.XMLParser(huge_tree=True))
-            except ValueError:
-                # Python3: when the fobj come from Story.create()
-                # it is strictly a textfile that cannot be implicitly
-                # read as a bytestring (required by etree.fromstring()).
-                dom = etree.fromstring(xml.encode('utf-8'))
+            shared = self.shared
+            dom = self.idml_package.get_parsed_part(self.name) if shared else None
+            if dom is None:
+                # Parse the stored members of the archive in place (see IDMLPackage.open_member()).
+                fobj = self.fobj
+                xml = fobj.getbuffer() if isinstance(fobj, StoredMember) else fobj.read()
+                try:
+                    dom = self.idml_package.parse_part(xml)
+                except ValueError:
+                    # Python3: when the fobj come from Story.create()
+                    # it is strictly a textfile that cannot be implicitly
+                    # read as a bytestring (required by etree.fromstring()).
+                    dom = self.idml_package.parse_part(xml.encode('utf-8'))
+                self._fobj.close()
+                self._fobj = None
+                if shared:
+                    self.idml_package.parsed_parts[self.name] = dom
             self._dom = dom
-            self._fobj.close()
-            self._fobj = None
         return self._dom
 
     def tostring(self):
-        kwargs = {"xml_declaration": True,
+        """Serialize the file according to the options of its package (see IDMLPackage). """
+        xml_declaration = self.idml_package.xml_declaration
+        kwargs = {"xml_declaration": xml_declaration,
                   "encoding": "UTF-8",
-                  "standalone": True,
-                  "pretty_print": True}
+                  # lxml writes a declaration whenever standalone is set.
+                  "standalone": True if xml_declaration else None,
+                  "pretty_print": self.idml_package.pretty_print}
 
         if etree.LXML_VERSION < (2, 3):
             strn = etree.tostring(self.dom, **kwargs)
             if self.doctype:
                 lines = strn.splitlines()
-                lines.insert(1, self.doctype)
+                lines.insert(1 if xml_declaration else 0, self.doctype)
                 strn = "\n".join(line.decode("utf-8") for line in lines)
                 strn += "\n"
                 strn = strn.encode("utf-8")
@@ -115,22 +229,35 @@ class IDMLXMLFile():
         # Explicit initialization of dom from self._fobj before reset
         # because in tostring() we get the dom from this file if None.
         self.dom  # pylint: disable=pointless-statement
-        self.fobj.close()
-        self._fobj = None
+        if self._fobj is not None:
+            self._fobj.close()
+            self._fobj = None
 
         # Must instanciate with a working_copy to use this.
-        with open(os.path.join(self.working_copy_path, self.name), mode="wb+") as fobj:
-            fobj.write(self.tostring())
+        self.idml_package.working_copy.store(self)
+
+    @property
+    def index(self):
+        """The ElementIndex of the tree, shared like the tree itself (see dom). """
+        if self._index is None or self._index.root is not self.dom:
+            shared = self.shared
+            index = self.idml_package.element_indexes.get(self.name) if shared else None
+            if index is None or index.root is not self.dom:
+                index = ElementIndex(self.dom, self.indexed_attrs)
+                if shared:
+                    self.idml_package.element_indexes[self.name] = index
+            self._index = index
+        return self._index
 
     def get_element_by_id(self, value, tag="XMLElement", attr="Self"):
-        elem = self.dom.xpath(f"//{tag}[@{attr}='{value}']")
-        # etree FutureWarning when trying to simply do: elem = len(elem) and elem[0] or None
-        if len(elem):
-            elem = elem[0]
-            if elem.tag == "XMLElement":
-                elem = XMLElement(elem)
+        if attr in self.indexed_attrs:
+            elem = self.index.get(attr, value, tag)
         else:
-            elem = None
+            elem = self.dom.xpath(f"//{tag}[@{attr}='{value}']")
+            # etree FutureWarning when trying to simply do: elem = len(elem) and elem[0] or None
+            elem = elem[0] if len(elem) else None
+        if elem is not None and elem.tag == "XMLElement":
+            elem = XMLElement(elem)
         return elem
 
     def prefix_references(self, prefix):
@@ -165,6 +292,7 @@ class IDMLXMLFile():
         elt = self.dom.xpath("/Document")
         if elt and elt[0].get("StoryList"):
             elt[0].set("StoryList", " ".join([f"{prefix}{s}" for s in elt[0].get("StoryList").split(" ")]))
+        self.index.invalidate()
 
     def set_element_resource_path(self, element_id, resource_path, synchronize=False):
         """ For Spread and Story subclasses only (this comment is a call for a Mixin). """
@@ -184,8 +312,9 @@ class IDMLXMLFile():
         if elt.get("NoTextMarker"):
             elt.attrib.pop("NoTextMarker")
         if elt.get("XMLContent"):
-            elt.attrib.pop("XMLContent")
+            self.index.set(elt.element, "XMLContent", None)
         for child in elt.iterchildren():
+            self.index.remove(child)
             elt.remove(child)
         if synchronize:
             self.synchronize()
@@ -249,13 +378,20 @@ class Spread(IDMLXMLFile):
             # the last page is also the first (and only) one here and is a verso (front).
             face_required = RECTO
             last_page = self.pages[-1]
-            last_page.node.addnext(copy.deepcopy(page.node))
+            new_page_node = copy.deepcopy(page.node)
+            last_page.node.addnext(new_page_node)
         else:
             face_required = VERSO
-            self.node.append(copy.deepcopy(page.node))
+            new_page_node = copy.deepcopy(page.node)
+            self.node.append(new_page_node)
+        self.index.add(new_page_node)
+        self.idml_package.index_spread_element(self, new_page_node)
         # TODO: attributes (layer, masterSpread, ...)
         for item in page.page_items:
-            self.node.append(copy.deepcopy(item))
+            new_item = copy.deepcopy(item)
+            self.node.append(new_item)
+            self.index.add(new_item)
+            self.idml_package.index_spread_element(self, new_item)
         self._pages = None
 
         # Correct the position of the new page in the Spread.
@@ -278,6 +414,7 @@ class Spread(IDMLXMLFile):
             self.node.set(k, value)
 
         self._pages = None
+        self.index.invalidate()
 
     def get_node_name_from_xml_name(self):
         return rx_node_name_from_xml_name.match(self.name).groups()[0]
@@ -288,15 +425,27 @@ class Spread(IDMLXMLFile):
                 elt.set("ItemLayer", layer_id)
         self.synchronize()
 
+    def get_layer_usage(self):
+        """Count the items and, separately, the guides of the spread by layer in a single pass. """
+        items, guides = {}, {}
+        for elt in self.node.iterdescendants(etree.Element):
+            layer_id = elt.get("ItemLayer")
+            if layer_id is not None:
+                # The page Guide are not page items.
+                counts = guides if elt.tag == "Guide" else items
+                counts[layer_id] = counts.get(layer_id, 0) + 1
+        return items, guides
+
     def has_any_item_on_layer(self, layer_id):
         # The page Guide are not page items.
-        return bool(len(self.node.xpath(f".//*[not(self::Guide)][@ItemLayer='{layer_id}']")))
+        return bool(len(ITEMS_ON_LAYER(self.node, layer_id=layer_id)))
 
     def has_any_guide_on_layer(self, layer_id):
-        return bool(len(self.node.xpath(f".//Guide[@ItemLayer='{layer_id}']")))
+        return bool(len(GUIDES_ON_LAYER(self.node, layer_id=layer_id)))
 
     def remove_guides_on_layer(self, layer_id, synchronize=False):
-        for guide in self.node.xpath(f".//Guide[@ItemLayer='{layer_id}']"):
+        for guide in GUIDES_ON_LAYER(self.node, layer_id=layer_id):
+            self.index.remove(guide)
             guide.getparent().remove(guide)
         if synchronize:
             self.synchronize()
@@ -306,7 +455,9 @@ class Spread(IDMLXMLFile):
         elt = self.get_element_by_id(item_id, tag="*")
         if elt is None:
             elt = self.get_element_by_id(item_id, tag="*", attr="ParentStory")
+        self.index.remove(elt)
         elt.getparent().remove(elt)
+        self.idml_package.unindex_spread_element(elt)
         if synchronize:
             self.synchronize()
 
@@ -324,7 +475,9 @@ class Spread(IDMLXMLFile):
             except TypeError:
                 pass
         rectangle.addnext(textframe)
+        self.index.remove(rectangle)
         self.node.remove(rectangle)
+        self.index.add(textframe)
 
 
 STORIES_DIRNAME = "Stories"
@@ -339,18 +492,12 @@ class Story(IDMLXMLFile):
 
     @classmethod
     def create(cls, idml_package, story_id, xml_element_id, xml_element_tag, working_copy_path):
-        dirname = os.path.join(working_copy_path, STORIES_DIRNAME)
-        if not os.path.exists(dirname):
-            os.mkdir(dirname)
         story_name = f"{STORIES_DIRNAME}/Story_{story_id}.xml"
         story = Story(idml_package, story_name, working_copy_path)
 
         # Difficult to do it in .fobj() because we don't always need
         # to create a unexisting file.
-        filename = os.path.join(working_copy_path, story_name)
-        story._fobj = open(filename, mode="w+")
-        story.fobj.write(
-            f"""<?xml version='1.0' encoding='UTF-8' standalone='yes'?>
+        idml_package.working_copy.write(story_name, f"""<?xml version='1.0' encoding='UTF-8' standalone='yes'?>
    <idPkg:Story xmlns:idPkg="http://ns.adobe.com/AdobeInDesign/idml/1.0/packaging" DOMVersion="7.5">
      <Story Self="{story_id}" AppliedTOCStyle="n" TrackChanges="false" StoryTitle="$ID/" AppliedNamedGrid="n">
        <StoryPreference OpticalMarginAlignment="false" OpticalMarginSize="12" FrameType="TextFrameType" StoryOrientation="Horizontal" StoryDirection="LeftToRightDirection"/>
@@ -358,10 +505,8 @@ class Story(IDMLXMLFile):
        <XMLElement Self="{xml_element_id}" MarkupTag="XMLTag/{xml_element_tag}" XMLContent="{story_id}" />
      </Story>
 </idPkg:Story>
-""")
-
-        story.fobj.close()
-        story._fobj = None
+""".encode("utf-8"))
+        idml_package.add_to_manifest(story_name)
         return story
 
     @property
@@ -371,6 +516,29 @@ class Story(IDMLXMLFile):
             self._node = node
         return self._node
 
+    def get_skeleton(self):
+        """The tree of the story reduced to its tagged elements and their containers, without text.
+
+        The file is read with iterparse and the other elements are dropped as they are parsed,
+        so the whole tree is never in memory. The shared tree is returned if the story is parsed. """
+        dom = self.idml_package.get_parsed_part(self.name) if self.shared else None
+        if dom is not None:
+            return dom
+        with self.fobj as fobj:
+            context = etree.iterparse(fobj, events=("end",), huge_tree=True)
+            for _, elt in context:
+                elt.text = None
+                if elt.tag == "XMLElement" or elt.get("MarkupTag") or len(elt):
+                    continue
+                parent = elt.getparent()
+                if parent is not None:
+                    parent.remove(elt)
+            root = context.root
+        self._fobj = None
+        if self.idml_package.remove_blank_text:
+            strip_blank_text(root)
+        return root
+
     def set_element_attributes(self, element_id, attrs):
         element = self.get_element_by_id(element_id)
         element.set_attributes(attrs)
@@ -403,26 +571,19 @@ class Story(IDMLXMLFile):
         element = self.get_element_by_id(element_id)
         # We remove all `CharacterStyleRange' containers except the first.
         # FIXME: This should handle ./ParagraphStyleRange/CharacterStyleRange too.
-        children = element.xpath("./CharacterStyleRange")[1:]
+        children = CHARACTER_STYLE_RANGES(_get_etree_element(element))[1:]
         for child in children:
+            self.index.remove(child)
             element.remove(child)
+        # An empty text is None: the element is written <Content/>.
         for content_node in self.get_element_content_nodes(element):
-            content_node.text = ""
+            content_node.text = None
 
     def get_element_content_nodes(self, element):
-        return element.xpath(("./ParagraphStyleRange/CharacterStyleRange/Content | "
-                              "./CharacterStyleRange/Content | "
-                              "./XMLElement/CharacterStyleRange/Content | "
-                              "./Content"))
+        return CONTENT_NODES(_get_etree_element(element))
 
     def get_element_content_and_xmlelement_nodes(self, element):
-        return element.xpath(("./ParagraphStyleRange/CharacterStyleRange/Content | "
-                              "./CharacterStyleRange/Content | "
-                              "./ParagraphStyleRange/CharacterStyleRange/XMLElement | "
-                              "./CharacterStyleRange/XMLElement | "
-                              "./ParagraphStyleRange/XMLElement | "
-                              "./XMLElement | "
-                              "./Content"))
+        return CONTENT_AND_XMLELEMENT_NODES(_get_etree_element(element))
 
     def set_element_id(self, element):
         ref_element = list(element.itersiblings(tag="XMLElement", preceding=True))
@@ -436,10 +597,11 @@ class Story(IDMLXMLFile):
             else:
                 raise NotImplementedError
             position = "child"
-        element.set("Self", increment_xmltag_id(ref_element.get("Self"), position))
+        self.index.set(element, "Self", increment_xmltag_id(ref_element.get("Self"), position))
 
     def remove_element(self, element_id, synchronize=False):
         elt = self.get_element_by_id(element_id).element
+        self.index.remove(elt)
         elt.getparent().remove(elt)
         if synchronize:
             self.synchronize()
@@ -450,6 +612,7 @@ class Story(IDMLXMLFile):
         for i, child in enumerate(elt.iterchildren()):
             if i == 0 and keep_style and child.tag in ['ParagraphStyleRange', 'CharacterStyleRange']:
                 continue
+            self.index.remove(child)
             elt.remove(child)
         if synchronize:
             self.synchronize()
@@ -457,6 +620,7 @@ class Story(IDMLXMLFile):
     def add_element(self, element_destination_id, element):
         node = self.get_element_by_id(element_destination_id)
         node.append(element)
+        self.index.add(element)
         self.set_element_id(element)
 
     def add_content_to_element(self, element_id, content, parent=None):
@@ -558,6 +722,7 @@ class Designmap(IDMLXMLFile):
             self.spread_nodes[-1].addnext(
                 etree.Element("{%s}Spread" % IdPkgNS, src=spread.name)
             )
+        self.idml_package.add_to_manifest(spread.name)
 
     def prefix(self, prefix):
         self.prefix_active_layer(prefix)
@@ -581,17 +746,21 @@ class Designmap(IDMLXMLFile):
         for story in stories:
             elt.append(etree.Element("{http://ns.adobe.com/AdobeInDesign/idml/1.0/packaging}Story",
                                      src=f"Stories/Story_{story}.xml"))
+            self.idml_package.add_to_manifest(f"Stories/Story_{story}.xml")
 
     def add_layer_nodes(self, layer_nodes):
         current_layers_ids = [layer.get("Self") for layer in self.layer_nodes]
         for layer in reversed(layer_nodes):
             # If a similar layer is already present, we do not add it.
             if layer.get("Self") not in current_layers_ids:
-                self.layer_nodes[-1].addnext(copy.deepcopy(layer))
+                new_layer = copy.deepcopy(layer)
+                self.layer_nodes[-1].addnext(new_layer)
+                self.index.add(new_layer)
         self._layer_nodes = None
 
     def remove_layer(self, layer_id, synchronize=False):
         layer = self.get_element_by_id(layer_id, tag="Layer", attr="Self")
+        self.index.remove(layer)
         layer.getparent().remove(layer)
         self._layer_nodes = None
         if self.active_layer == layer_id:
@@ -611,17 +780,18 @@ class Designmap(IDMLXMLFile):
         if with_name:
             layer_0.set("Name", with_name)
         for layer in self.layer_nodes:
+            self.index.remove(layer)
             layer.getparent().remove(layer)
         self._layer_nodes = None
         self.active_layer = layer_0.get("Self")
         self.synchronize()
 
     def get_layer_id_by_name(self, layer_name):
-        layer_node = self.dom.xpath(f".//Layer[@Name='{layer_name}']")[0]
+        layer_node = LAYER_BY_NAME(self.dom, name=layer_name)[0]
         return layer_node.get("Self")
 
     def get_active_layer_name(self):
-        layer_node = self.dom.xpath(f".//Layer[@Self='{self.active_layer}']")[0]
+        layer_node = LAYER_BY_ID(self.dom, layer_id=self.active_layer)[0]
         return layer_node.get("Name")
 
 
@@ -629,7 +799,7 @@ class Style(IDMLXMLFile):
     name = "Resources/Styles.xml"
 
     def get_style_node_by_name(self, style_name):
-        return self.dom.xpath(f".//CharacterStyle[@Self='{style_name}']")[0]
+        return CHARACTER_STYLE_BY_ID(self.dom, style_id=style_name)[0]
 
     def style_groups(self):
         """ Groups are `RootCharacterStyleGroup', `RootParagraphStyleGroup' etc. """
@@ -682,11 +852,8 @@ class StyleMapping(IDMLXMLFile):
         return self._character_style_mapping
 
     def _initialize_fobj(self):
-        filename = os.path.join(self.working_copy_path, self.name)
-        fobj = open(filename, mode="w+")
-        fobj.write(self.initial_dom)
-        fobj.seek(0)
-        self._fobj = fobj
+        self.idml_package.working_copy.write(self.name, self.initial_dom.encode("utf-8"))
+        self._fobj = self.idml_package.working_copy.open(self.name)
 
     def iter_stylenode(self):
         for node in self.dom.xpath("//XMLImportMap"):
@@ -812,8 +979,7 @@ class Page():
         """
 
         item_transform = [Decimal(c) for c in page_item.get("ItemTransform").split(" ")]
-        #TODO factoriser "Properties/PathGeometry/GeometryPathType/PathPointArray/PathPointType"
-        point = page_item.xpath("Properties/PathGeometry/GeometryPathType/PathPointArray/PathPointType")[0]
+        point = PATH_POINTS(page_item)[0]
         x, y = [Decimal(c) for c in point.get("Anchor").split(" ")]
         x = x + item_transform[4]
         y = y + item_transform[5]
@@ -863,7 +1029,7 @@ class XMLElement(Proxy):
 
     def add_content(self, content, parent=None, style_range_node=None):
         content_element = etree.Element("Content")
-        content_element.text = content
+        content_element.text = content or None
         if style_range_node is None:
             style_range_node = parent.clone_style_range()
         style_range_node.append(content_element)
@@ -871,7 +1037,7 @@ class XMLElement(Proxy):
 
     def set_content(self, content):
         try:
-            self.get_element_content_nodes()[0].text = content
+            self.get_element_content_nodes()[0].text = content or None
         except IndexError:
             return
         # Ticket #8 - Fix the style locally.
@@ -929,12 +1095,12 @@ class XMLElement(Proxy):
         return attr_node.get("Value") if attr_node is not None else None
 
     def _get_attribute_node(self, name):
-        attr_node = self.xpath(f"./XMLAttribute[@Name='{name}']")
+        attr_node = XMLATTRIBUTE_BY_NAME(self.element, name=name)
         if len(attr_node):
             return attr_node[0]
 
     def get_attributes(self):
-        return {node.get("Name"): node.get("Value") for node in self.xpath("./XMLAttribute")}
+        return {node.get("Name"): node.get("Value") for node in XMLATTRIBUTES(self.element)}
 
     def set_attribute(self, name, value):
         attr_node = self._get_attribute_node(name)
@@ -956,7 +1122,7 @@ class XMLElement(Proxy):
 
     def get_local_character_style_range(self):
         try:
-            node = self.xpath(("./ParagraphStyleRange/CharacterStyleRange | ./CharacterStyleRange"))[0]
+            node = LOCAL_CHARACTER_STYLE_RANGES(self.element)[0]
         except (IndexError, AttributeError):
             node = None
         return node
@@ -967,12 +1133,8 @@ class XMLElement(Proxy):
             node = None
         return node
 
-    # TODO: factorize with Story.get_element_content_nodes().
     def get_element_content_nodes(self):
-        return self.xpath(("./ParagraphStyleRange/CharacterStyleRange/Content | "
-                           "./CharacterStyleRange/Content | "
-                           "./XMLElement/CharacterStyleRange/Content | "
-                           "./Content"))
+        return CONTENT_NODES(self.element)
 
     def to_xml_structure_element(self):
         """Return the node as seen in the Structure panel of InDesign. """
@@ -1016,3 +1178,8 @@ def get_idml_xml_file_by_name(idml_package, name, working_copy_path=None):
         klass = StyleMapping
 
     return klass(**kwargs)
+
+
+def _get_etree_element(node):
+    """The compiled XPath expressions need the etree.Element behind a XMLElement proxy. """
+    return node.element if isinstance(node, XMLElement) else node
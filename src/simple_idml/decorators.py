@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 
+import io
 import os
 import shutil
 from tempfile import NamedTemporaryFile
@@ -18,42 +19,92 @@ def simple_decorator(decorator):
     return new_decorator
 
 
+def open_working_copy(idml_package):
+    """Create the working copy of the package with its working copy backend. """
+    idml_package.reset_parts()
+    idml_package.working_copy = idml_package.working_copy_backend(idml_package)
+    idml_package.init_lazy_references()
+
+
+def discard_working_copy(idml_package):
+    """Drop the working copy, leaving the original archive untouched. """
+    working_copy = idml_package.working_copy
+    idml_package.working_copy = None
+    idml_package.reset_parts()
+    idml_package.init_lazy_references()
+    if working_copy is not None:
+        working_copy.cleanup()
+
+
+def commit_working_copy(idml_package):
+    """Repack the working copy in place of the original archive.
+
+    The package is closed and the new archive is returned: its filename, or a io.BytesIO
+    if the package has been opened from a file object (nothing is written on disk then). """
+    if idml_package.filename is None:
+        new_file = io.BytesIO()
+        idml_package._repack(new_file)  # pylint: disable=protected-access
+        new_file.seek(0)
+        idml_package.close()
+    else:
+        # Create a new archive from the working copy, next to the original one.
+        new_file = idml_package.filename
+        with NamedTemporaryFile(dir=os.path.dirname(os.path.abspath(new_file)),
+                                suffix=".idml", delete=False) as tmp_package:
+            idml_package._repack(tmp_package)  # pylint: disable=protected-access
+
+        # swap working_copy with initial IDML Package.
+        idml_package.close()
+        os.unlink(idml_package.filename)
+        shutil.move(tmp_package.name, new_file)
+    idml_package.working_copy.cleanup()
+    idml_package.working_copy = None
+    idml_package.reset_parts()
+    return new_file
+
+
 @simple_decorator
 def use_working_copy(view_func):
     def new_func(idml_package, *args, **kwargs):
-        if idml_package.working_copy_path is not None:
-            return view_func(idml_package, *args, **kwargs)
+        # Nested calls and calls inside an editing session (IDMLPackage.edit())
+        # reuse the working copy: no extraction and no repack.
+        if idml_package.working_copy is not None:
+            if idml_package.working_copy_calls:
+                return view_func(idml_package, *args, **kwargs)
+            # A call at the top level of a session: the lazy references (stories, spreads...)
+            # are rebuilt afterwards as a new package would do (the parsed parts are kept).
+            # The methods keep the XML structure up to date.
+            idml_package.working_copy_calls += 1
+            try:
+                return view_func(idml_package, *args, **kwargs)
+            finally:
+                idml_package.working_copy_calls -= 1
+                idml_package.init_lazy_references(keep_xml_structure=True)
 
-        tmp_filename = NamedTemporaryFile().name
-        idml_package.extractall(tmp_filename)
-        idml_package.working_copy_path = tmp_filename
-        idml_package.init_lazy_references()
+        open_working_copy(idml_package)
 
+        # The nested calls are not top-level calls of a session.
+        idml_package.working_copy_calls += 1
         if idml_package.debug:
             # In debug it is useful to have the original trace.
-            idml_package = view_func(idml_package, *args, **kwargs)
+            try:
+                result = view_func(idml_package, *args, **kwargs)
+            finally:
+                idml_package.working_copy_calls -= 1
         else:
-            # Catch any exception to reset working_copy_path.
+            # Catch any exception to drop the working copy.
             try:
-                idml_package = view_func(idml_package, *args, **kwargs)
+                result = view_func(idml_package, *args, **kwargs)
             except BaseException as err:
-                idml_package.working_copy_path = None
+                idml_package.working_copy_calls -= 1
+                discard_working_copy(idml_package)
                 raise err
+            idml_package.working_copy_calls -= 1
+        idml_package = result
 
-        # Create a new archive from the extracted one.
-        # Use the newly added _repack method in IDMLPackage
-        tmp_package_filename = f"{tmp_filename}.idml"
-        idml_package._repack(tmp_package_filename)
+        new_file = commit_working_copy(idml_package)
 
-        # swap working_copy with initial IDML Package.
-        new_filename = idml_package.filename
-        idml_package.close()
-        os.unlink(idml_package.filename)
-        shutil.move(tmp_package_filename, new_filename)
-        shutil.rmtree(tmp_filename)
-        idml_package.working_copy_path = None
-        
         from simple_idml.idml import IDMLPackage  # pylint: disable=import-outside-toplevel
-        return IDMLPackage(new_filename)
+        return IDMLPackage(new_file, **idml_package.options)
 
     return new_func
@@ -1,38 +1,113 @@
 # -*- coding: utf-8 -*-
 
 import copy
+import io
+import mmap
 import os
+from contextlib import contextmanager
 import re
 import shutil
+import struct
+import threading
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from decimal import Decimal
+from tempfile import NamedTemporaryFile
 from lxml import etree
 from simple_idml import BACKINGSTORY, SETCONTENT_TAG, IGNORECONTENT_TAG, FORCECONTENT_TAG
 from simple_idml.components import get_idml_xml_file_by_name
 from simple_idml.components import (Designmap, Spread, Story, BackingStory,
-                                    Style, StyleMapping, Graphic, Tags, Fonts, XMLElement)
-from simple_idml.decorators import use_working_copy
-from simple_idml.utils import increment_filename, prefix_content_filename, tree_to_etree_dom
+                                    Style, StyleMapping, Graphic, Tags, Fonts, XMLElement, ElementIndex)
+from simple_idml.cache import PackageCache, get_archive_key
+from simple_idml.manifest import PackageManifest
+from simple_idml.import_plan import ImportPlan, ImportStep, get_flags
+from simple_idml.decorators import (use_working_copy, open_working_copy,
+                                    commit_working_copy, discard_working_copy)
+from simple_idml.xpaths import PATH_POINTS, XMLTAG_BY_ID
+from simple_idml.utils import (increment_filename, prefix_content_filename, tree_to_etree_dom,
+                               data_to_etree_dom, iterparse_records, strip_blank_text)
+from simple_idml.working_copy import (DirectoryWorkingCopy, MemoryWorkingCopy, StoredMember,
+                                      get_working_copy_backend, get_directory_namelist)
 
 STORIES_DIRNAME = "Stories"
 
 
 class IDMLPackage(zipfile.ZipFile):
-    """An IDML file (a package) is a Zip-stored archive/UCF container. """
+    """An IDML file (a package) is a Zip-stored archive/UCF container.
+
+    The files are modified in a working copy (see simple_idml.working_copy) created by the
+    methods decorated with `use_working_copy' or by edit(). It is extracted in a temporary
+    directory by default. Use `working_copy_backend="memory"' to keep it in memory.
+
+    With `write_behind=True' the modified parts are serialized once, when the working copy
+    is repacked or flushed (see flush()), instead of at every synchronize().
+
+    With `workers=N' the independent parts are parsed, prefixed, extracted and serialized
+    by a pool of N threads. There is no pool by default.
+
+    The serialization of the XML files is set by `pretty_print', `xml_declaration' and
+    `remove_blank_text' (drop the whitespaces between the elements when parsing, but the text
+    of <Content>). Use `pretty_print=False' and `remove_blank_text=True' for compact files.
+
+    A package can also be used as a template: see clone().
+
+    With `stream_xml_structure', the stories are read with iterparse to discover the XML
+    structure, keeping only their XMLElements in memory (see Story.get_skeleton()).
+
+    With `cache_dir', the XML structure, the manifest, the spread of the page items and the
+    layer usage of an unmodified package are stored in (and read from) that directory,
+    under a key computed from the content of the archive (see PackageCache).
+    """
     debug = False
+    working_copy_backend = DirectoryWorkingCopy
+    write_behind = False
+    workers = None
+    pretty_print = True
+    xml_declaration = True
+    remove_blank_text = False
+    stream_xml_structure = False
+    cache_dir = None
+    working_copy_calls = 0
+    # The keyword arguments of IDMLPackage() setting the attribute of the same name.
+    option_names = ("working_copy_backend", "write_behind", "workers",
+                    "pretty_print", "xml_declaration", "remove_blank_text", "stream_xml_structure",
+                    "cache_dir")
 
     def __init__(self, *args, **kwargs):
         kwargs["compression"] = zipfile.ZIP_STORED
+        options = {name: kwargs.pop(name, None) for name in self.option_names}
+        # close() is called by ZipFile if the archive cannot be opened.
+        self._mmap = None
+        self._mmap_lock = threading.Lock()
+        self._executor = None
         zipfile.ZipFile.__init__(self, *args, **kwargs)
-        self.working_copy_path = None
+        if options["working_copy_backend"] is not None:
+            options["working_copy_backend"] = get_working_copy_backend(options["working_copy_backend"])
+        for name, value in options.items():
+            if value is not None:
+                setattr(self, name, value)
+        self.working_copy = None
+        self.reset_parts()
+        self.template = None
+        self._cache = None
         self.init_lazy_references()
 
     def __repr__(self):
-        return f"<idml.IDMLPackage instance of '{os.path.basename(self.filename)}' at {hex(id(self))}>"
-
-    def init_lazy_references(self):
-        self._xml_structure = None
-        self._xml_structure_tree = None
+        name = os.path.basename(self.filename) if self.filename else self.fp
+        return f"<idml.IDMLPackage instance of '{name}' at {hex(id(self))}>"
+
+    def init_lazy_references(self, keep_xml_structure=False):
+        """Drop the lazy attributes. The methods maintaining xml_structure, manifest and spread_ids
+        (see index_spread_element()) keep them, and the style range prototypes which are dropped
+        when the styles change (see mark_dirty()). """
+        if not keep_xml_structure:
+            self._xml_structure = None
+            self._xml_structure_tree = None
+            self._xml_structure_index = None
+            self._xml_structure_paths = {}
+            self._manifest = None
+            self._spread_ids = None
+            self._style_range_prototypes = {}
         self._designmap = None
         self._tags = None
         self._font_families = None
@@ -47,21 +122,150 @@ class IDMLPackage(zipfile.ZipFile):
         self._backing_story = None
         self._stories = None
         self._story_ids = None
+        self._layer_usage = None
         self._referenced_layers = None
 
+    @property
+    def working_copy_path(self):
+        """Identify the working copy. It is None when the package is not being modified. """
+        if self.working_copy is None:
+            return None
+        return self.working_copy.path
+
+    @property
+    def options(self):
+        """The keyword arguments to open another IDMLPackage with the same options. """
+        return {name: getattr(self, name) for name in self.option_names}
+
     def namelist(self):
-        if not self.working_copy_path:
+        if self.working_copy is None:
             return zipfile.ZipFile.namelist(self)
-        namelist = []
-        for root, dirs, filenames in os.walk(self.working_copy_path):
-            rel_root = root.replace(self.working_copy_path, "")[1:]
-            for filename in filenames:
-                namelist.append("%(rel_root)s%(sep)s%(filename)s" % {
-                    'rel_root': rel_root,
-                    'sep': rel_root and "/" or "",
-                    'filename': filename
-                })
-        return namelist
+        return self.working_copy.namelist()
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        self._close_mmap()
+        zipfile.ZipFile.close(self)
+
+    def open_member(self, name):
+        """Open the archive member `name' for reading.
+
+        The stored members of an archive read from a file are mapped in memory (see StoredMember):
+        the parser reads them in place instead of a copy. The others are opened by ZipFile.open(). """
+        info = self.getinfo(name)
+        if info.compress_type != zipfile.ZIP_STORED or info.flag_bits & 0x1 or self.mode != "r":
+            return self.open(info, mode="r")
+        # The members may be opened by the threads of map_parts().
+        with self._mmap_lock:
+            if self._mmap is None:
+                try:
+                    fileno = self.fp.fileno()
+                except (AttributeError, OSError, io.UnsupportedOperation):
+                    return self.open(info, mode="r")
+                self._mmap = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+
+        header = self._mmap[info.header_offset:info.header_offset + zipfile.sizeFileHeader]
+        header = struct.unpack(zipfile.structFileHeader, header)
+        if header[zipfile._FH_SIGNATURE] != zipfile.stringFileHeader:  # pylint: disable=protected-access
+            raise zipfile.BadZipFile(f"Bad magic number for file header of '{name}'")
+        start = (info.header_offset + zipfile.sizeFileHeader +
+                 header[zipfile._FH_FILENAME_LENGTH] +  # pylint: disable=protected-access
+                 header[zipfile._FH_EXTRA_FIELD_LENGTH])  # pylint: disable=protected-access
+        with memoryview(self._mmap) as view:
+            return StoredMember(view[start:start + info.compress_size])
+
+    def _close_mmap(self):
+        with self._mmap_lock:
+            if self._mmap is not None:
+                try:
+                    self._mmap.close()
+                except BufferError:
+                    # A StoredMember is still open: the map is released with it.
+                    pass
+                self._mmap = None
+
+    def read_part(self, name):
+        """The content of the part `name', from the working copy if the package is being modified. """
+        if self.working_copy is None:
+            return self.read(name)
+        return self.working_copy.read(name)
+
+    def reset_parts(self):
+        """Drop the state of the parts (see mark_dirty()) when the package gets a new source:
+        a new working copy or archive. """
+        self.dirty_parts = set()
+        self.parsed_parts = {}
+        self.element_indexes = {}
+
+    def mark_dirty(self, name):
+        """Flag the part `name' as changed in the working copy (it will be rewritten by _repack()).
+
+        The parsed trees of the parts are kept in `parsed_parts' (name -> root element) and shared
+        by the IDMLXMLFile instances so a part is parsed once per working copy. Their indexes
+        (see IDMLXMLFile.index) are kept in `element_indexes'. """
+        self.dirty_parts.add(name)
+        if name in (Style.name, StyleMapping.name):
+            self._style_range_prototypes = {}
+
+    def get_parsed_part(self, name):
+        """The shared tree of the part `name' or None if it has not been parsed yet.
+
+        A clone (see clone()) gets a copy of the tree of its template, unless the part
+        has been written in its working copy. """
+        dom = self.parsed_parts.get(name)
+        if dom is None and self.template is not None and name not in self.dirty_parts:
+            template_dom = self.template.get_template_part(name)
+            if template_dom is not None:
+                dom = copy.deepcopy(template_dom)
+                self.parsed_parts[name] = dom
+        return dom
+
+    def parse_part(self, xml):
+        """The tree of the part content `xml' (bytes or a buffer), parsed with the options of the package. """
+        dom = etree.fromstring(xml, parser=etree.XMLParser(huge_tree=True))
+        if self.remove_blank_text:
+            strip_blank_text(dom)
+        return dom
+
+    def get_template_part(self, name):
+        """The tree of the part `name' parsed from the archive, once. None if there is no such part. """
+        dom = self.parsed_parts.get(name)
+        if dom is None:
+            try:
+                fobj = self.open_member(name)
+            except KeyError:
+                return None
+            with fobj:
+                xml = fobj.getbuffer() if isinstance(fobj, StoredMember) else fobj.read()
+                dom = self.parse_part(xml)
+            self.parsed_parts[name] = dom
+        return dom
+
+    def flush(self):
+        """Serialize the parts whose write has been deferred (see `write_behind'). """
+        if self.working_copy is not None:
+            self.working_copy.flush()
+
+    def map_parts(self, function, names):
+        """Return [function(name) for name in names], computed by the pool of `workers' threads if any.
+
+        function must only modify the part `name' and must not call map_parts(). The pool is created
+        on the first call and reused until close(). """
+        names = list(names)
+        if not self.workers or self.workers < 2 or len(names) < 2:
+            return [function(name) for name in names]
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        return list(self._executor.map(function, names))
+
+    def parse_parts(self, names):
+        """Parse the parts `names' ahead of their use (see map_parts()). """
+        def parse(name):
+            get_idml_xml_file_by_name(self, name, self.working_copy_path).dom  # pylint: disable=pointless-statement
+
+        self.map_parts(parse, [name for name in names if name not in self.parsed_parts])
 
     def contentfile_namelist(self):
         """Namelist filtered on Spreads and Stories. """
@@ -74,41 +278,135 @@ class IDMLPackage(zipfile.ZipFile):
         Starting at BackingStory.xml where the root-element is expected (because unused). """
 
         if self._xml_structure is None:
-            source_node = self.backing_story.get_root()
-            structure = source_node.to_xml_structure_element()
-
-            def append_childs(source_node, destination_node):
-                """Recursive function to discover node structure from a story to another. """
-                for elt in source_node.iterchildren():
-                    if not elt.tag == "XMLElement":
-                        append_childs(elt, destination_node)
-                    if elt.get("Self") == source_node.get("Self"):
-                        continue
-                    if not elt.get("MarkupTag"):
-                        continue
-                    elt = XMLElement(elt)
-                    new_destination_node = elt.to_xml_structure_element()
-                    destination_node.append(new_destination_node)
-                    if elt.get("XMLContent"):
-                        xml_content_value = elt.get("XMLContent")
-                        story_name = f"Stories/Story_{xml_content_value}.xml"
-                        story = Story(self, name=story_name, working_copy_path=self.working_copy_path)
-                        try:
-                            new_source_node = story.get_element_by_id(elt.get("Self"))
-                        # The story does not exists (i.e. for an image).
-                        except KeyError:
-                            continue
-                        except FileNotFoundError:
-                            continue
-                        else:
-                            append_childs(new_source_node, new_destination_node)
-                    else:
-                        append_childs(elt, new_destination_node)
-
-            append_childs(source_node, structure)
+            cache = self.cache
+            if cache is not None and cache.get("xml_structure") is not None:
+                structure = etree.fromstring(cache.get("xml_structure"))
+            else:
+                source_node = self._get_xml_structure_root()
+                if self.workers and not self.stream_xml_structure:
+                    self._parse_xml_structure_stories(source_node)
+                structure = source_node.to_xml_structure_element()
+                self._append_xml_structure_children(source_node, structure)
+                if cache is not None:
+                    cache.set("xml_structure", etree.tostring(structure, encoding="unicode"))
             self._xml_structure = structure  # pylint: disable=attribute-defined-outside-init
         return self._xml_structure
 
+    def _get_xml_structure_root(self):
+        """The root XMLElement in BackingStory.xml. """
+        if self.stream_xml_structure:
+            backing_story = BackingStory(self, working_copy_path=self.working_copy_path)
+            return XMLElement(backing_story.get_skeleton().find("*//XMLElement"))
+        return self.backing_story.get_root()
+
+    def _get_xml_structure_source(self, story_name, element_id):
+        """The XMLElement element_id in story_name, None if there is no such story or element. """
+        story = Story(self, name=story_name, working_copy_path=self.working_copy_path)
+        try:
+            if self.stream_xml_structure:
+                skeleton = story.get_skeleton()
+                return next(skeleton.iterfind(f".//XMLElement[@Self='{element_id}']"), None)
+            element = story.get_element_by_id(element_id)
+        # The story does not exists (i.e. for an image).
+        except KeyError:
+            return None
+        except FileNotFoundError:
+            return None
+        # The element may have been removed from its story.
+        return element.element if element is not None else None
+
+    def _parse_xml_structure_stories(self, source_node):
+        """Parse the stories referenced from source_node, level by level (see parse_parts()). """
+        names = set(self.namelist())
+        seen = set()
+        nodes = [source_node]
+        while nodes:
+            story_names = []
+            for node in nodes:
+                for xml_content in node.xpath(".//XMLElement/@XMLContent"):
+                    story_name = f"{STORIES_DIRNAME}/Story_{xml_content}.xml"
+                    if story_name in names and story_name not in seen:
+                        seen.add(story_name)
+                        story_names.append(story_name)
+            self.parse_parts(story_names)
+            nodes = [self.get_parsed_part(story_name) for story_name in story_names]
+            nodes = [node for node in nodes if node is not None]
+
+    def _append_xml_structure_children(self, source_node, destination_node):
+        """Discover the structure under source_node, from a story to another.
+
+        An explicit stack is used so deep structures do not reach the recursion limit. """
+        # Items are (source, destination, iterator over the children of source) or, for a tagged
+        # element which is not an <XMLElement>, (element, destination, None): it is appended
+        # after its descendants.
+        stack = [(source_node, destination_node, source_node.iterchildren())]
+        while stack:
+            source, destination, children = stack[-1]
+            if children is None:
+                stack.pop()
+                destination.append(self._get_xml_structure_element(XMLElement(source), stack))
+                continue
+            elt = next(children, None)
+            if elt is None:
+                stack.pop()
+                continue
+            tagged = elt.get("Self") != source.get("Self") and elt.get("MarkupTag")
+            if not elt.tag == "XMLElement":
+                if tagged:
+                    stack.append((elt, destination, None))
+                stack.append((elt, destination, elt.iterchildren()))
+            elif tagged:
+                destination.append(self._get_xml_structure_element(XMLElement(elt), stack))
+
+    def _get_xml_structure_element(self, elt, stack=None):
+        """The node of xml_structure for the XMLElement elt, with its children.
+
+        If stack is given, the discovery of the children is pushed on it. """
+        new_destination_node = elt.to_xml_structure_element()
+        if elt.get("XMLContent"):
+            story_name = f"{STORIES_DIRNAME}/Story_{elt.get('XMLContent')}.xml"
+            new_source_node = self._get_xml_structure_source(story_name, elt.get("Self"))
+        else:
+            new_source_node = elt.element
+        if new_source_node is not None:
+            if stack is None:
+                self._append_xml_structure_children(new_source_node, new_destination_node)
+            else:
+                stack.append((new_source_node, new_destination_node, new_source_node.iterchildren()))
+        return new_destination_node
+
+    def refresh_xml_structure_node(self, at):
+        """Discover again the node `at' of xml_structure (see get_xml_structure_node()) from the stories.
+
+        The methods modifying the XMLElements of the stories call it on the top-most node they
+        changed rather than dropping the whole structure. The node is replaced in place. """
+        node = self.get_xml_structure_node(at)
+        parent = node.getparent()
+        if parent is None:
+            self._xml_structure = None  # pylint: disable=attribute-defined-outside-init
+            self._xml_structure_tree = None  # pylint: disable=attribute-defined-outside-init
+            return
+
+        # The element is looked up where its parent found its children.
+        if parent.getparent() is None:
+            source_node = self._get_xml_structure_root()
+        else:
+            source_node = self.get_story_object_by_xpath(parent).get_element_by_id(parent.get("Self"))
+        if source_node is None:
+            self.refresh_xml_structure_node(parent)
+            return
+
+        self.xml_structure_index.remove(node)
+        for elt in source_node.iterdescendants("XMLElement"):
+            if elt.get("Self") == node.get("Self") and elt.get("MarkupTag"):
+                new_node = self._get_xml_structure_element(XMLElement(elt))
+                parent.replace(node, new_node)
+                self.xml_structure_index.add(new_node)
+                break
+        # The element has been removed from its story.
+        else:
+            parent.remove(node)
+
     def xml_structure_pretty(self):
         return etree.tostring(self.xml_structure, pretty_print=True)
 
@@ -119,6 +417,65 @@ class IDMLPackage(zipfile.ZipFile):
             self._xml_structure_tree = xml_structure_tree
         return self._xml_structure_tree
 
+    @property
+    def xml_structure_index(self):
+        """The nodes of the xml_structure by `Self' and `XMLContent' values. """
+        if self._xml_structure_index is None or self._xml_structure_index.root is not self.xml_structure:
+            xml_structure_index = ElementIndex(self.xml_structure, ("Self", "XMLContent"))
+            self._xml_structure_index = xml_structure_index  # pylint: disable=attribute-defined-outside-init
+            self._xml_structure_paths = {}  # pylint: disable=attribute-defined-outside-init
+        return self._xml_structure_index
+
+    def get_xml_structure_node(self, at):
+        """Return the xml_structure node designated by `at'.
+
+        `at' is a XPath (i.e. `/Root/article[1]'), the `Self' or `XMLContent' value of a node
+        or a node itself. A node of a previous xml_structure is looked up by its `Self' value.
+        The node found for a XPath is reused as long as its path is still `at'.
+        IndexError is raised if there is no such node. """
+        xml_structure = self.xml_structure
+        index = self.xml_structure_index
+        if isinstance(at, etree._Element):  # pylint: disable=protected-access
+            if at.getroottree().getroot() is xml_structure:
+                return at
+            at = at.get("Self")
+            node = index.get("Self", at)
+        elif "/" not in at:
+            node = index.get("Self", at)
+            if node is None:
+                node = index.get("XMLContent", at)
+        else:
+            node = self._xml_structure_paths.get(at)
+            # The structure may have changed since: the node moved, removed or replaced.
+            if (node is None or node.getroottree().getroot() is not xml_structure or
+                    node.getroottree().getpath(node) != at):
+                nodes = xml_structure.xpath(at)
+                node = nodes[0] if nodes else None
+                if node is not None:
+                    self._xml_structure_paths[at] = node
+        if node is None:
+            raise IndexError(f"There is no node '{at}' in the XML structure.")
+        return node
+
+    @property
+    def cache(self):
+        """The PackageCache of the archive, None without `cache_dir' or if the package is modified. """
+        if self.cache_dir is None or self.dirty_parts:
+            return None
+        if self._cache is None:
+            self._cache = PackageCache(self.cache_dir, get_archive_key(self))
+        return self._cache
+
+    def _get_cached(self, name, compute):
+        """The value `name' from the cache, or computed by the function compute (and cached). """
+        cache = self.cache
+        value = cache.get(name) if cache is not None else None
+        if value is None:
+            value = compute()
+            if cache is not None:
+                cache.set(name, value)
+        return value
+
     @property
     def designmap(self):
         if self._designmap is None:
@@ -129,21 +486,21 @@ class IDMLPackage(zipfile.ZipFile):
     @property
     def tags(self):
         if self._tags is None:
-            tags = [copy.deepcopy(elt) for elt in Tags(self).tags()]
+            tags = [copy.deepcopy(elt) for elt in Tags(self, self.working_copy_path).tags()]
             self._tags = tags  # pylint: disable=attribute-defined-outside-init
         return self._tags
 
     @property
     def font_families(self):
         if self._font_families is None:
-            font_families = [copy.deepcopy(elt) for elt in Fonts(self).fonts()]
+            font_families = [copy.deepcopy(elt) for elt in Fonts(self, self.working_copy_path).fonts()]
             self._font_families = font_families  # pylint: disable=attribute-defined-outside-init
         return self._font_families
 
     @property
     def style_groups(self):
         if self._style_groups is None:
-            style_groups = [copy.deepcopy(elt) for elt in Style(self).style_groups()]
+            style_groups = [copy.deepcopy(elt) for elt in Style(self, self.working_copy_path).style_groups()]
             self._style_groups = style_groups  # pylint: disable=attribute-defined-outside-init
         return self._style_groups
 
@@ -169,10 +526,30 @@ class IDMLPackage(zipfile.ZipFile):
             self._graphic = graphic  # pylint: disable=attribute-defined-outside-init
         return self._graphic
 
+    @property
+    def manifest(self):
+        """The stories, spreads, master spreads and resources of the package (see PackageManifest). """
+        if self._manifest is None:
+            manifest = PackageManifest(**self._get_cached(
+                "manifest", lambda: PackageManifest.build(self.namelist(), self.designmap.dom).as_dict()))
+            self._manifest = manifest  # pylint: disable=attribute-defined-outside-init
+        return self._manifest
+
+    def add_to_manifest(self, name):
+        """Register the part `name', just added to the working copy, in manifest. """
+        if self._manifest is not None:
+            self._manifest.add(name)
+        self._spreads = None  # pylint: disable=attribute-defined-outside-init
+        self._spreads_objects = None  # pylint: disable=attribute-defined-outside-init
+        self._stories = None  # pylint: disable=attribute-defined-outside-init
+        self._story_ids = None  # pylint: disable=attribute-defined-outside-init
+        self._layer_usage = None  # pylint: disable=attribute-defined-outside-init
+        self._referenced_layers = None  # pylint: disable=attribute-defined-outside-init
+
     @property
     def spreads(self):
         if self._spreads is None:
-            spreads = [elt for elt in self.namelist() if re.match("^Spreads/*", elt)]
+            spreads = list(self.manifest.spreads.values())
             self._spreads = spreads  # pylint: disable=attribute-defined-outside-init
         return self._spreads
 
@@ -183,6 +560,48 @@ class IDMLPackage(zipfile.ZipFile):
             self._spreads_objects = spreads_objects  # pylint: disable=attribute-defined-outside-init
         return self._spreads_objects
 
+    @property
+    def spread_ids(self):
+        """Map the `Self' and `ParentStory' values of the spread elements to the name of the
+        (first) spread holding them. See get_spread_object_by_id(). """
+        if self._spread_ids is None:
+            def get_spread_ids():
+                spread_ids = {}
+                for spread in self.spreads_objects:
+                    for attr in ("Self", "ParentStory"):
+                        for elt in spread.dom.xpath(f"//*[@{attr}]"):
+                            spread_ids.setdefault(elt.get(attr), spread.name)
+                return spread_ids
+            spread_ids = self._get_cached("spread_ids", get_spread_ids)
+            self._spread_ids = spread_ids  # pylint: disable=attribute-defined-outside-init
+        return self._spread_ids
+
+    def index_spread_element(self, spread, element):
+        """Register element and its descendants, just inserted in spread, in spread_ids. """
+        if self._spread_ids is None:
+            return
+        for elt in element.iter(etree.Element):
+            for attr in ("Self", "ParentStory"):
+                value = elt.get(attr)
+                if value is None:
+                    continue
+                current = self._spread_ids.get(value)
+                if current is None or (current != spread.name and current in self.spreads and
+                                       self.spreads.index(spread.name) < self.spreads.index(current)):
+                    self._spread_ids[value] = spread.name
+
+    def unindex_spread_element(self, element):
+        """Update spread_ids after the removal of element from its spread. """
+        if self._spread_ids is None:
+            return
+        for elt in element.iter(etree.Element):
+            for attr in ("Self", "ParentStory"):
+                value = elt.get(attr)
+                if value is not None and self._spread_ids.pop(value, None) is not None:
+                    spread = self._find_spread_object_by_id(value)
+                    if spread is not None:
+                        self._spread_ids[value] = spread.name
+
     @property
     def last_spread(self):
         if self._last_spread is None:
@@ -210,21 +629,21 @@ class IDMLPackage(zipfile.ZipFile):
     @property
     def stories(self):
         if self._stories is None:
-            stories = [elt for elt in self.namelist()
-                       if re.match(f"^{STORIES_DIRNAME}/*", elt)]
+            stories = list(self.manifest.stories.values())
             self._stories = stories  # pylint: disable=attribute-defined-outside-init
         return self._stories
 
     def stories_for_node(self, node_path):
         return [f"{STORIES_DIRNAME}/Story_{child.get('XMLContent')}.xml"
-                for child in self.xml_structure.xpath(node_path)[0].iter()
-                if child.get("XMLContent") in self.story_ids]
+                for child in self.get_xml_structure_node(node_path).iter()
+                if child.get("XMLContent") in self.manifest.story_ids]
 
     @property
     def story_ids(self):
         """ extract  `ID' from `Stories/Story_ID.xml'. """
         if self._story_ids is None:
-            self._story_ids = self._get_story_ids_for_stories(self.stories)  # pylint: disable=attribute-defined-outside-init
+            story_ids = list(self.manifest.story_ids)
+            self._story_ids = story_ids  # pylint: disable=attribute-defined-outside-init
         return self._story_ids
 
     def story_ids_for_node(self, node_path):
@@ -234,27 +653,175 @@ class IDMLPackage(zipfile.ZipFile):
         rx_story_id = re.compile(r"%s/Story_([\w]+)\.xml" % STORIES_DIRNAME)
         return [rx_story_id.match(elt).group(1) for elt in stories]
 
+    @property
+    def layer_usage(self):
+        """Map the spread names to the number of items and, separately, of guides by layer:
+        {spread_name: [{layer_id: items}, {layer_id: guides}]} (see Spread.get_layer_usage()). """
+        if self._layer_usage is None:
+            layer_usage = self._get_cached("layer_usage", lambda: {
+                spread.name: list(spread.get_layer_usage()) for spread in self.spreads_objects})
+            self._layer_usage = layer_usage  # pylint: disable=attribute-defined-outside-init
+        return self._layer_usage
+
+    def count_layer_items(self, layer_id, guides=False):
+        """The number of spread items (or guides) on the layer. """
+        return sum(usage[1 if guides else 0].get(layer_id, 0) for usage in self.layer_usage.values())
+
     @property
     def referenced_layers(self):
+        """The ids of the layers holding some spread items, in the designmap order. """
         if self._referenced_layers is None:
-            referenced_layers = []
-            for layer in self.designmap.layer_nodes:
-                layer_id = layer.get("Self")
-                for spread in self.spreads_objects:
-                    if spread.has_any_item_on_layer(layer_id):
-                        referenced_layers.append(layer_id)
+            referenced_layers = [layer.get("Self") for layer in self.designmap.layer_nodes
+                                 if self.count_layer_items(layer.get("Self"))]
             self._referenced_layers = referenced_layers  # pylint: disable=attribute-defined-outside-init
         return self._referenced_layers
 
     @use_working_copy
     def import_xml(self, xml, at):
-        """ Reproduce the action «Import XML» on a XML Element in InDesign® Structure. """
+        """ Reproduce the action «Import XML» on a XML Element in InDesign® Structure.
 
-        # Python 3 strictly require a bytestring.
-        try:
-            source_node = etree.fromstring(xml)
-        except ValueError:
-            source_node = etree.fromstring(xml.encode("utf-8"))
+        xml is a string or an etree.Element. """
+
+        source_node = xml if etree.iselement(xml) else self._parse_xml_fragment(xml)
+        return self._import_xml(source_node, at)
+
+    @use_working_copy
+    def import_xml_file(self, source, at):
+        """Import the XML file `source' (a path or a binary file object) like import_xml(), without loading it.
+
+        The children of its root element (the records) are parsed, imported and released one at a
+        time (see iterparse_records()) so the memory used does not depend on the size of the file.
+        The records are matched with the children of `at' one after the other, like import_xml()
+        does when their tags differ. The modified parts are serialized once, at the end. """
+        records = iterparse_records(source)
+        source_node = next(records)
+        with self._deferred_writes():
+            return self._import_xml(source_node, self.get_xml_structure_node(at), records)
+
+    @use_working_copy
+    def bind(self, data, at, tree=False):
+        """Import data at `at' like import_xml() imports a XML fragment, without XML string.
+
+        data is nested dicts and lists (see data_to_etree_dom()), the root being the node `at',
+        or an export_as_tree() tree if `tree' is True. The attributes `simpleidml-setcontent', `simpleidml-ignorecontent'
+        and `simpleidml-forcecontent' have the same meaning:
+
+            >>> idml_package.bind({"@simpleidml-setcontent": "clear",
+            ...                    "title": "Foo",
+            ...                    "content": {"#text": "Bar", "@simpleidml-forcecontent": True}},
+            ...                   at="/Root/article[1]")
+        """
+        destination_node = self.get_xml_structure_node(at)
+        if tree:
+            source_node = tree_to_etree_dom(data)
+        else:
+            source_node = data_to_etree_dom(destination_node.tag, data)
+        return self._import_xml(source_node, destination_node)
+
+    def compile_import(self, sample, at):
+        """Resolve once the destinations of the import at `at' of the records shaped like sample.
+
+        sample is a XML string, an etree.Element or some data (see bind()). The returned ImportPlan
+        is given to apply_import() with each record. A ValueError is raised if importing sample
+        changes the XML structure (new nodes, `simpleidml-setcontent' with `clear', `delete' or
+        `remove-previous-br', an empty `href'): use import_xml() for such records. """
+        destination_node = self.get_xml_structure_node(at)
+        source_node = self._get_source_node(sample, destination_node.tag)
+        return ImportPlan(destination_node.get("Self"), self._compile_import_step(source_node, destination_node))
+
+    def _compile_import_step(self, source_node, destination_node, ignorecontent_parent_flag=False):
+        """The ImportStep of source_node, following _import_xml(). """
+        items = dict(source_node.items())
+        content_flags = items.get(SETCONTENT_TAG, "").split(',')
+        if {"clear", "delete", "remove-previous-br"} & set(content_flags) or items.get("href") == "":
+            raise ValueError(f"The import of <{source_node.tag}> changes the XML structure.")
+
+        forcecontent = (items.get(FORCECONTENT_TAG) == "true")
+        active = not ignorecontent_parent_flag or forcecontent
+        spread = self.get_spread_object_by_xpath(destination_node)
+        step = ImportStep(source_node.tag, get_flags(source_node),
+                          element_id=destination_node.get("Self"),
+                          story_name=self.get_story_by_xpath(destination_node),
+                          content_id=destination_node.get("XMLContent"),
+                          spread_name=spread.name if spread else None,
+                          set_attributes=active,
+                          set_content=active and "false" not in content_flags)
+
+        ignorecontent = (items.get(IGNORECONTENT_TAG) == "true") or (ignorecontent_parent_flag and not forcecontent)
+        source_node_children = source_node.getchildren()
+        destination_node_children = list(destination_node.iterchildren())
+        if [n.tag for n in source_node_children] == [n.tag for n in destination_node_children]:
+            step.children = [self._compile_import_step(s, d, ignorecontent)
+                             for s, d in zip(source_node_children, destination_node_children)]
+        elif len(source_node_children):
+            destination_node_children = iter(destination_node_children)
+            destination_node_child = next(destination_node_children, None)
+            for source_child in source_node_children:
+                if destination_node_child is not None and source_child.tag == destination_node_child.tag:
+                    step.children.append(self._compile_import_step(source_child, destination_node_child, ignorecontent))
+                    destination_node_child = next(destination_node_children, None)
+                elif not ignorecontent and source_child.tag in self.style_mapping.character_style_mapping.keys():
+                    raise ValueError(f"The import of <{source_child.tag}> adds a node to the XML structure.")
+                else:
+                    step.children.append(ImportStep(source_child.tag, get_flags(source_child)))
+            step.move_siblings = True
+        return step
+
+    @use_working_copy
+    def apply_import(self, plan, record):
+        """Import record like import_xml() at the destinations resolved by compile_import().
+
+        Only the attributes and the content are set and each modified story is serialized once.
+        A record which has not the shape of the sample of the plan is imported by import_xml(). """
+        source_node = self._get_source_node(record, plan.root.tag)
+        if not plan.matches(source_node):
+            return self._import_xml(source_node, self.get_xml_structure_node(plan.at))
+
+        xml_files = {}
+
+        def _get_xml_file(name):
+            xml_file = xml_files.get(name)
+            if xml_file is None:
+                xml_file = get_idml_xml_file_by_name(self, name, self.working_copy_path)
+                xml_files[name] = xml_file
+            return xml_file
+
+        def _apply_step(step, source_node):
+            if step.element_id is None:
+                return
+            story = _get_xml_file(step.story_name)
+            items = dict(source_node.items())
+            if step.set_attributes and items:
+                story.set_element_attributes(step.element_id, items)
+                # Image references must be updated in the page item in Spread or Story.
+                if "href" in items:
+                    story.set_element_resource_path(step.content_id, items["href"])
+                    if step.spread_name:
+                        _get_xml_file(step.spread_name).set_element_resource_path(step.content_id, items["href"])
+            if step.set_content:
+                story.set_element_content(step.element_id, source_node.text or "")
+            for child_step, source_child in zip(step.children, source_node):
+                _apply_step(child_step, source_child)
+            if step.move_siblings:
+                self._move_siblings_content(story, step.element_id)
+
+        _apply_step(plan.root, source_node)
+        for xml_file in xml_files.values():
+            xml_file.synchronize()
+        return self
+
+    def _get_source_node(self, source, tag):
+        """The etree.Element of an import: source is a XML string, an etree.Element or some data
+        (see bind()) whose root is named `tag'. """
+        if etree.iselement(source):
+            return source
+        if isinstance(source, (str, bytes)):
+            return self._parse_xml_fragment(source)
+        return data_to_etree_dom(tag, source)
+
+    def _import_xml(self, source_node, at, records=None):
+        """Import source_node at `at'. The children of source_node are taken from the iterator
+        records instead if it is given (see import_xml_file()). """
 
         def _set_content(xpath, element_id, content, story=None):
             story = story or self.get_story_object_by_xpath(xpath)
@@ -302,26 +869,34 @@ class IDMLPackage(zipfile.ZipFile):
         def _get_nested_style_range_node(xml_structure_node):
             """Use the more distant parent as base style and then apply its children styles until the new tag itself.
 
+            The merged style range of a chain of mapped styles is computed once and copied.
+
             Returns:
              o new_style_range_node: unbound element.
              o root_style_node
             """
-            nested_styles = []
+            character_style_mapping = self.style_mapping.character_style_mapping
+            style_names = []
             while xml_structure_node is not None :
-                style_name = self.style_mapping.character_style_mapping.get(xml_structure_node.tag)
+                style_name = character_style_mapping.get(xml_structure_node.tag)
                 if style_name:
-                    style_node = self.style.get_style_node_by_name(style_name)
-                    nested_styles.insert(0, style_node)
+                    style_names.insert(0, style_name)
                 xml_structure_node = xml_structure_node.getparent()
 
-            # Merge the styles starting from the top parent like in a HTML document.
-            root_style_node = nested_styles.pop(0)
-            new_style_range_node = etree.Element("CharacterStyleRange", AppliedCharacterStyle=root_style_node.get("Self"))
-            etree.SubElement(new_style_range_node, "Properties")
-            for style_to_apply_node in nested_styles:
-                _apply_style(new_style_range_node, style_to_apply_node, root_style_node)
-
-            return new_style_range_node, root_style_node
+            prototype = self._style_range_prototypes.get(tuple(style_names))
+            if prototype is None:
+                nested_styles = [self.style.get_style_node_by_name(style_name) for style_name in style_names]
+                # Merge the styles starting from the top parent like in a HTML document.
+                root_style_node = nested_styles.pop(0)
+                new_style_range_node = etree.Element("CharacterStyleRange", AppliedCharacterStyle=root_style_node.get("Self"))
+                etree.SubElement(new_style_range_node, "Properties")
+                for style_to_apply_node in nested_styles:
+                    _apply_style(new_style_range_node, style_to_apply_node, root_style_node)
+                prototype = (new_style_range_node, root_style_node)
+                self._style_range_prototypes[tuple(style_names)] = prototype
+
+            new_style_range_node, root_style_node = prototype
+            return copy.deepcopy(new_style_range_node), root_style_node
 
         def _apply_parent_style_range(style_range_node, applied_style_node, parent):
             """Parent CharacterStyleRange must be set locally. """
@@ -344,31 +919,12 @@ class IDMLPackage(zipfile.ZipFile):
                     properties_element.append(copy.deepcopy(parent_attr_node))
 
         def _move_siblings_content(at, element_id):
-            """ When new XML elements are inserted, the siblings of the initial <content>
-                (<br> only to avoid moving newly created elements) are
-                repositionned after the last <content> created.
-            """
             story = self.get_story_object_by_xpath(at)
-            element = story.get_element_by_id(element_id)
-            content_nodes = element.get_element_content_nodes()
-            if len(content_nodes) < 2:
-                return
-
-            first_content_node = content_nodes[0]
-            last_content_node = content_nodes[-1]
-            siblings = list(first_content_node.itersiblings(['br', 'Br', 'BR']))
-            if not len(siblings):
-                return
-
-            for sibling in siblings:
-                try:
-                    last_content_node.addnext(sibling)
-                except ValueError:  # "cannot add ancestor as sibling, please break cycle first"
-                    pass
-            story.synchronize()
+            if self._move_siblings_content(story, element_id):
+                story.synchronize()
 
         def _import_new_node(source_node, at=None, element_id=None, story=None):
-            xml_structure_parent_node = self.xml_structure.find(f"*//*[@Self='{element_id}']")
+            xml_structure_parent_node = self.xml_structure_index.get("Self", element_id)
             xml_structure_new_node = etree.Element(source_node.tag)
             # We cannot force the self._xml_structure reset by setting it at None.
             xml_structure_parent_node.append(xml_structure_new_node)
@@ -382,7 +938,7 @@ class IDMLPackage(zipfile.ZipFile):
             new_xml_element.add_content(source_node.text, parent, style_range_node)
             story.add_element(element_id, new_xml_element.element)
 
-            xml_structure_new_node.set("Self", new_xml_element.get("Self"))
+            self.xml_structure_index.set(xml_structure_new_node, "Self", new_xml_element.get("Self"))
 
             # Source may also contains some children.
             source_node_children = source_node.getchildren()
@@ -398,7 +954,7 @@ class IDMLPackage(zipfile.ZipFile):
             story.synchronize()
 
         def _import_node(source_node, at=None, element_id=None, story=None, ignorecontent_parent_flag=False):
-            element_id = element_id or self.xml_structure.xpath(at)[0].get("Self")
+            element_id = element_id or self.get_xml_structure_node(at).get("Self")
             items = dict(source_node.items())
 
             forcecontent = (items.get(FORCECONTENT_TAG) == "true")
@@ -421,7 +977,7 @@ class IDMLPackage(zipfile.ZipFile):
                     local_story.remove_element(element_id, synchronize=True)
                     spread = self.get_spread_object_by_xpath(at)
                     if spread:
-                        content_id = self.xml_structure.xpath(at)[0].get("XMLContent")
+                        content_id = self.get_xml_structure_node(at).get("XMLContent")
                         spread.remove_page_item(content_id, synchronize=True)
                 elif "false" not in content_flags:
                     _set_content(at, element_id, source_node.text or "", story)
@@ -430,15 +986,14 @@ class IDMLPackage(zipfile.ZipFile):
             source_node_children = source_node.getchildren()
             if len(source_node_children):
                 source_node_children_tags = [n.tag for n in source_node_children]
-                destination_node = self.xml_structure.xpath(at)[0]
+                destination_node = self.get_xml_structure_node(at)
                 destination_node_children = destination_node.iterchildren()
                 destination_node_children_tags = [n.tag for n in destination_node.iterchildren()]
                 # Childrens in source node (xml file) and destination node are an exact match,
                 # we can call a map() on _import_node().
                 # FIXME: what if source_node.text exists ?
                 if destination_node_children_tags == source_node_children_tags:
-                    for s, d in zip(source_node_children, [self.xml_structure_tree.getpath(c) for c in
-                                                           destination_node.iterchildren()]):
+                    for s, d in zip(source_node_children, list(destination_node.iterchildren())):
                         _import_node(s, at=d, ignorecontent_parent_flag=ignorecontent)
 
                 # Step-by-step iteration.
@@ -447,7 +1002,7 @@ class IDMLPackage(zipfile.ZipFile):
                     for source_child in source_node_children:
                         # Source and destination match.
                         if destination_node_child is not None and source_child.tag == destination_node_child.tag:
-                            _import_node(source_child, at=self.xml_structure_tree.getpath(destination_node_child),
+                            _import_node(source_child, at=destination_node_child,
                                          ignorecontent_parent_flag=ignorecontent)
                             destination_node_child = next(destination_node_children, None)
                         # Source does not match destination. It is added, but only if the tag is mapped to a style.
@@ -456,33 +1011,116 @@ class IDMLPackage(zipfile.ZipFile):
 
                     _move_siblings_content(at, element_id)
 
+        def _import_records(source_node, records, at):
+            """Step-by-step iteration over the records as they are parsed. """
+            element_id = self.get_xml_structure_node(at).get("Self")
+            ignorecontent = (source_node.get(IGNORECONTENT_TAG) == "true")
+            destination_node_children = self.get_xml_structure_node(at).iterchildren()
+            destination_node_child = next(destination_node_children, None)
+            source_child = None
+            for source_child in records:
+                if destination_node_child is not None and source_child.tag == destination_node_child.tag:
+                    self._clear_destination(source_child, destination_node_child)
+                    _import_node(source_child, at=destination_node_child, ignorecontent_parent_flag=ignorecontent)
+                    destination_node_child = next(destination_node_children, None)
+                elif not ignorecontent and source_child.tag in self.style_mapping.character_style_mapping.keys():
+                    _import_new_node(source_child, at, element_id)
+            # Like the step-by-step iteration of _import_node() (a source without children has none).
+            if source_child is not None:
+                _move_siblings_content(at, element_id)
+
         self._clear_destination(source_node, at)
-        self.init_lazy_references()
         _import_node(source_node, at)
+        if records is not None:
+            _import_records(source_node, records, at)
+        self.refresh_xml_structure_node(at)
         return self
 
+    @use_working_copy
+    def import_xml_many(self, fragments):
+        """Import each (xml, at) of fragments like import_xml(), in a single working copy.
+
+        The fragments are parsed and their destinations looked up before any import: `at' refers
+        to the XML structure as it is before the call and an IndexError is raised if it is not
+        found. The fragments are imported in their order, a destination may be inside another
+        one, and the modified parts are serialized once, when all are done. """
+        imports = []
+        for xml, at in fragments:
+            source_node = xml if etree.iselement(xml) else self._parse_xml_fragment(xml)
+            imports.append((source_node, self.get_xml_structure_node(at)))
+
+        with self._deferred_writes():
+            for source_node, destination_node in imports:
+                self.import_xml(source_node, destination_node)
+        return self
+
+    @contextmanager
+    def _deferred_writes(self):
+        """Serialize the parts modified in the block once, when leaving it (see `write_behind'). """
+        write_behind = self.write_behind
+        self.write_behind = True
+        try:
+            yield
+        finally:
+            self.write_behind = write_behind
+            if not write_behind:
+                self.flush()
+
+    @staticmethod
+    def _parse_xml_fragment(xml):
+        # Python 3 strictly require a bytestring.
+        try:
+            return etree.fromstring(xml)
+        except ValueError:
+            return etree.fromstring(xml.encode("utf-8"))
+
+    def _move_siblings_content(self, story, element_id):
+        """ When new XML elements are inserted, the siblings of the initial <content>
+            (<br> only to avoid moving newly created elements) are
+            repositionned after the last <content> created.
+
+            Return True if the story has been modified.
+        """
+        element = story.get_element_by_id(element_id)
+        content_nodes = element.get_element_content_nodes()
+        if len(content_nodes) < 2:
+            return False
+
+        first_content_node = content_nodes[0]
+        last_content_node = content_nodes[-1]
+        siblings = list(first_content_node.itersiblings(['br', 'Br', 'BR']))
+        if not len(siblings):
+            return False
+
+        for sibling in siblings:
+            try:
+                last_content_node.addnext(sibling)
+            except ValueError:  # "cannot add ancestor as sibling, please break cycle first"
+                pass
+        return True
+
     def _clear_destination(self, source_node, at):
         """ Remove content marked for removal before importing XML. """
 
-        element_id = self.xml_structure.xpath(at)[0].get("Self")
+        destination_node = self.get_xml_structure_node(at)
+        element_id = destination_node.get("Self")
         items = dict(source_node.items())
 
         content_flags = items.get(SETCONTENT_TAG, "").split(',')
         if "clear" in content_flags:
             story = self.get_story_object_by_xpath(at)
             story.remove_children(element_id, keep_style=True, synchronize=True)
-            self._xml_structure.xpath(at)[0].clear()
+            self.refresh_xml_structure_node(destination_node)
+            return
 
         source_node_children = source_node.getchildren()
         if len(source_node_children):
             source_node_children_tags = [n.tag for n in source_node_children]
-            destination_node = self.xml_structure.xpath(at)[0]
             destination_node_children = destination_node.iterchildren()
             destination_node_children_tags = [n.tag for n in destination_node.iterchildren()]
 
             if destination_node_children_tags == source_node_children_tags:
-                for s, d in zip(source_node_children,
-                                [self.xml_structure_tree.getpath(c) for c in destination_node_children]):
+                for s, d in zip(source_node_children, list(destination_node_children)):
                     self._clear_destination(s, at=d)
 
             # Step-by-step iteration.
@@ -490,8 +1128,7 @@ class IDMLPackage(zipfile.ZipFile):
                 destination_node_child = next(destination_node_children, None)
                 for source_child in source_node_children:
                     if destination_node_child is not None and source_child.tag == destination_node_child.tag:
-                        self._clear_destination(source_child,
-                                                at=self.xml_structure_tree.getpath(destination_node_child))
+                        self._clear_destination(source_child, at=destination_node_child)
                         destination_node_child = next(destination_node_children, None)
 
     @use_working_copy
@@ -503,7 +1140,7 @@ class IDMLPackage(zipfile.ZipFile):
         # The <PDF> element get the id of the <Rectangle>.
         spread_elt = self.get_spread_elem_by_xpath(at)
         element_id = self.get_element_content_id_by_xpath(at)
-        spread_elt.set("Self", f"{element_id}-old")
+        spread.index.set(spread_elt, "Self", f"{element_id}-old")
         x, y = self.get_elem_point_position(spread_elt)
         pdf_node = etree.fromstring(f"""<PDF Self="{element_id}" GrayVectorPolicy="IgnoreAll" RGBVectorPolicy="IgnoreAll" CMYKVectorPolicy="IgnoreAll" OverriddenPageItemProps="" LocalDisplaySetting="Default" ImageTypeName="$ID/Adobe Portable Document Format (PDF)" AppliedObjectStyle="ObjectStyle/$ID/[None]" ItemTransform="1 0 0 1 {x} {y}" ParentInterfaceChangeCount="" TargetInterfaceChangeCount="" LastUpdatedInterfaceChangeCount="" HorizontalLayoutConstraints="FlexibleDimension FixedDimension FlexibleDimension" VerticalLayoutConstraints="FlexibleDimension FixedDimension FlexibleDimension" Visible="true" Name="$ID/">
         <TextWrapPreference Inverse="false" ApplyToMasterPageOnly="false" TextWrapSide="BothSides" TextWrapMode="None">
@@ -521,12 +1158,14 @@ class IDMLPackage(zipfile.ZipFile):
     </PDF>""")
 
         spread_elt.append(pdf_node)
+        spread.index.add(pdf_node)
+        self.index_spread_element(spread, spread_elt)
         spread.synchronize()
         return self
 
     @use_working_copy
     def set_attributes(self, xpath, items, element_id=None):
-        element_id = element_id or self.xml_structure.xpath(xpath)[0].get("Self")
+        element_id = element_id or self.get_xml_structure_node(xpath).get("Self")
         story = self.get_story_object_by_xpath(xpath)
         story.set_element_attributes(element_id, items)
         # Image references must be updated in the page item in Spread or Story.
@@ -538,6 +1177,7 @@ class IDMLPackage(zipfile.ZipFile):
                 story.remove_xml_element_page_items(element_id)
                 if spread:
                     spread.remove_page_item(element_content_id, synchronize=True)
+                self.refresh_xml_structure_node(xpath)
             else:
                 story.set_element_resource_path(element_content_id, resource_path)
                 if spread:
@@ -562,8 +1202,7 @@ class IDMLPackage(zipfile.ZipFile):
                     "attrs": {},
                     "content": content}
             # Explore the story to discover the content and the attributes.
-            xpath = self.xml_structure_tree.getpath(xml_structure_node)
-            story = self.get_story_object_by_xpath(xpath)
+            story = self.get_story_object_by_xpath(xml_structure_node)
 
             try:
                 story.fobj
@@ -627,8 +1266,7 @@ class IDMLPackage(zipfile.ZipFile):
                     "attrs": {},
                     "content": content}
             # Explore the story to discover the content and the attributes.
-            xpath = self.xml_structure_tree.getpath(xml_structure_node)
-            story = self.get_story_object_by_xpath(xpath)
+            story = self.get_story_object_by_xpath(xml_structure_node)
 
             try:
                 story.fobj
@@ -684,29 +1322,30 @@ class IDMLPackage(zipfile.ZipFile):
             raise BaseException("Prefix must be alphanumeric.")
 
         # Change the references inside the file.
-        for filename in self.namelist():
-            if (
-                os.path.basename(filename) in ["container.xml", "metadata.xml"] or
-                os.path.splitext(filename)[1] != ".xml"
-            ):
-                continue
+        def prefix_references(filename):
             idml_xml_file = get_idml_xml_file_by_name(self, filename, self.working_copy_path)
             idml_xml_file.prefix_references(prefix)
             idml_xml_file.synchronize()
 
+        self.map_parts(prefix_references, [
+            filename for filename in self.namelist()
+            if not (os.path.basename(filename) in ["container.xml", "metadata.xml"] or
+                    os.path.splitext(filename)[1] != ".xml")
+        ])
+
         # Story and Spread XML files are "prefixed".
         for filename in self.contentfile_namelist():
             new_basename = prefix_content_filename(os.path.basename(filename),
                                                    prefix, "filename")
             # mv file in the new archive with the prefix.
-            old_name = os.path.join(self.working_copy_path, filename)
-            new_name = os.path.join(os.path.dirname(old_name), new_basename)
-            os.rename(old_name, new_name)
+            self.working_copy.rename(filename, f"{os.path.dirname(filename)}/{new_basename}")
 
         # Update designmap.xml.
         self.designmap.prefix(prefix)
         self.designmap.synchronize()
 
+        # Every reference has changed.
+        self.init_lazy_references()
         return self
 
     def is_prefixed(self, prefix):
@@ -733,7 +1372,6 @@ class IDMLPackage(zipfile.ZipFile):
         self._add_stories_from_idml(idml_package, at, only)
         self._add_layers_from_idml(idml_package, at, only)
         self.remove_orphan_layers()
-        self._xml_structure = None  # pylint: disable=attribute-defined-outside-init
         return self
 
     @use_working_copy
@@ -743,20 +1381,19 @@ class IDMLPackage(zipfile.ZipFile):
             if len(node.getchildren()):
                 for child in node.iterchildren():
                     _remove_content(child)
-            xpath = self.xml_structure_tree.getpath(node)
-            element_content_id = self.get_element_content_id_by_xpath(xpath)
+            element_content_id = node.get("XMLContent")
 
-            story = self.get_story_object_by_xpath(xpath)
+            story = self.get_story_object_by_xpath(node)
             story.clear_element_content(node.get("Self"))
             story.remove_element(node.get("Self"), synchronize=True)
             # call story.remove_xml_element_page_items() for images ?
 
-            spread = self.get_spread_object_by_xpath(xpath)
+            spread = self.get_spread_object_by_xpath(node)
             if spread:
                 spread.remove_page_item(element_content_id, synchronize=True)
 
         try:
-            node = self.xml_structure.xpath(under)[0]
+            node = self.get_xml_structure_node(under)
         except IndexError as exc:
             raise IndexError(f"Cannot remove content under path '{under}'."
                              " Are you sure the path exists?") from exc
@@ -764,17 +1401,18 @@ class IDMLPackage(zipfile.ZipFile):
         for child in node.iterchildren():
             _remove_content(child)
         # `under' node may have a reference to its first children in his story.
-        story = self.get_story_object_by_xpath(under)
+        story = self.get_story_object_by_xpath(node)
         story.remove_children(node.get("Self"), synchronize=True)
 
-        self.init_lazy_references()
+        self.refresh_xml_structure_node(node)
+        self.init_lazy_references(keep_xml_structure=True)
         return self
 
     @use_working_copy
     def remove_orphan_layers(self):
         for layer in self.designmap.layer_nodes:
             layer_id = layer.get("Self")
-            if layer_id not in self.referenced_layers:
+            if not self.count_layer_items(layer_id):
                 self.remove_layer(layer_id)
         return self
 
@@ -787,8 +1425,10 @@ class IDMLPackage(zipfile.ZipFile):
     @use_working_copy
     def remove_guides_on_layer(self, layer_id):
         for spread in self.spreads_objects:
-            if spread.has_any_guide_on_layer(layer_id):
+            guides = self.layer_usage[spread.name][1]
+            if guides.get(layer_id):
                 spread.remove_guides_on_layer(layer_id, synchronize=True)
+                del guides[layer_id]
         return self
 
     def _add_font_families_from_idml(self, idml_package):
@@ -840,7 +1480,7 @@ class IDMLPackage(zipfile.ZipFile):
         tags.working_copy_path = self.working_copy_path
         tags_root_elt = tags.get_root()
         for tag in idml_package.tags:
-            if not tags_root_elt.xpath(f"//XMLTag[@Self='{tag.get('Self')}']"):
+            if not XMLTAG_BY_ID(tags_root_elt, tag_id=tag.get("Self")):
                 tags_root_elt.append(copy.deepcopy(tag))
         tags.synchronize()
 
@@ -879,7 +1519,7 @@ class IDMLPackage(zipfile.ZipFile):
         spread_dest = Spread(self, spread_dest_filename, self.working_copy_path)
         spread_dest_elt = spread_dest.dom.xpath("./Spread")[0]
 
-        only_node = idml_package.xml_structure.xpath(only)[0]
+        only_node = idml_package.get_xml_structure_node(only)
 
         # Add spread elements on the same layer. We start by that because the order in the
         # Spread file is the z-position on the Layer.
@@ -904,12 +1544,14 @@ class IDMLPackage(zipfile.ZipFile):
             spread_elt_copy = copy.deepcopy(spread_elt)
             self.apply_translation_to_element(spread_elt_copy, translation)
             spread_dest_elt.append(spread_elt_copy)
+            spread_dest.index.add(spread_elt_copy)
+            self.index_spread_element(spread_dest, spread_elt_copy)
 
         for elt in spread_elts_to_add:
             _add_spread_element(spread_dest_elt, elt)
 
         spread_dest.synchronize()
-        self.init_lazy_references()
+        self.init_lazy_references(keep_xml_structure=True)
 
     def _add_stories_from_idml(self, idml_package, at, only):
         """Add all idml_package stories and insert `only' refence at `at' position in self.
@@ -948,22 +1590,22 @@ class IDMLPackage(zipfile.ZipFile):
 
         """
 
-        xml_element_src_id = idml_package.xml_structure.xpath(only)[0].get("Self")
+        xml_element_src_id = idml_package.get_xml_structure_node(only).get("Self")
         story_src_filename = idml_package.get_story_by_xpath(only)
-        story_src = Story(idml_package, story_src_filename)
+        story_src = Story(idml_package, story_src_filename, idml_package.working_copy_path)
         story_src_elt = story_src.get_element_by_id(xml_element_src_id).element
 
-        xml_element_dest = self.xml_structure.xpath(at)[0]
+        xml_element_dest = self.get_xml_structure_node(at)
         xml_element_dest_id = xml_element_dest.get("Self")
         content_ref = xml_element_dest.get("XMLContent")
 
         # We don't want to lose the XMLContent referencing the spread page item.
         # Neither we want to wipe the page item out from the spread.
         # To keep the document valid, the solution is to create a proxy story.
-        if content_ref and (content_ref not in self.story_ids):
+        if content_ref and (content_ref not in self.manifest.story_ids):
             self.add_story_with_content(content_ref, xml_element_dest_id, xml_element_dest.tag)
             self.xml_element_leaf_to_node(at, content_ref)
-            xml_element_dest = self.xml_structure.xpath(at)[0]
+            xml_element_dest = self.get_xml_structure_node(at)
 
         story_dest_filename = self.get_story_by_xpath(at)
         story_dest = Story(self, story_dest_filename, self.working_copy_path)
@@ -974,22 +1616,19 @@ class IDMLPackage(zipfile.ZipFile):
             for child in story_src_elt_copy.iterchildren():
                 story_src_elt_copy.remove(child)
         story_dest_elt.append(story_src_elt_copy)
+        story_dest.index.add(story_src_elt_copy)
         story_dest.synchronize()
 
         # Add Story files.
-        # `Stories' directory may not be present in the destination package.
-        stories_dirname = os.path.join(self.working_copy_path, STORIES_DIRNAME)
-        if not os.path.exists(stories_dirname):
-            os.mkdir(stories_dirname)
         for filename in idml_package.stories_for_node(only):
-            with open(os.path.join(self.working_copy_path, filename), mode="wb+") as story_cp:
-                story_cp.write(idml_package.open(filename, mode="r").read())
+            self.working_copy.write(filename, idml_package.read_part(filename))
 
         # Update designmap.xml.
         self.designmap.add_stories(idml_package.story_ids_for_node(only))
         self.designmap.synchronize()
         # BackingStory.xml ??
-        self.init_lazy_references()
+        self.init_lazy_references(keep_xml_structure=True)
+        self.refresh_xml_structure_node(xml_element_dest)
 
     def _add_layers_from_idml(self, idml_package, at, only):
         self.designmap.add_layer_nodes(idml_package.designmap.layer_nodes)
@@ -1009,7 +1648,7 @@ class IDMLPackage(zipfile.ZipFile):
 
         page = idml_package.pages[page_number - 1]
         last_spread.add_page(page)
-        self.init_lazy_references()
+        self.init_lazy_references(keep_xml_structure=True)
         last_spread.synchronize()
 
         self._add_stories_from_idml(idml_package, at, only)
@@ -1024,12 +1663,12 @@ class IDMLPackage(zipfile.ZipFile):
         Story.create(self, story_id, xml_element_id, xml_element_tag, self.working_copy_path)
         self.designmap.add_stories([story_id])
         self.designmap.synchronize()
-        self.init_lazy_references()
+        self.init_lazy_references(keep_xml_structure=True)
         return self
 
     @use_working_copy
     def add_note(self, note, author, at, when=None):
-        element_id = self.xml_structure.xpath(at)[0].get("Self")
+        element_id = self.get_xml_structure_node(at).get("Self")
         story = self.get_story_object_by_xpath(at)
         story.add_note(element_id, note, author, when)
         story.synchronize()
@@ -1041,9 +1680,13 @@ class IDMLPackage(zipfile.ZipFile):
         self.designmap.merge_layers(with_name)
         layer_id = self.designmap.active_layer
 
-        # Update ItemLayer in spread elements.
+        # Update ItemLayer in the spreads using the other layers.
         for spread_object in self.spreads_objects:
-            spread_object.set_layer_references(layer_id)
+            items, guides = self.layer_usage[spread_object.name]
+            if (set(items) | set(guides)) - {layer_id}:
+                spread_object.set_layer_references(layer_id)
+        self._layer_usage = None  # pylint: disable=attribute-defined-outside-init
+        self._referenced_layers = None  # pylint: disable=attribute-defined-outside-init
         return self
 
     @use_working_copy
@@ -1051,8 +1694,9 @@ class IDMLPackage(zipfile.ZipFile):
         spread = self.get_spread_object_by_xpath(xpath)
         page_item = spread.get_element_by_id(xml_content_ref, tag="*", attr="Self")
 
-        page_item.set("ParentStory", xml_content_ref)
-        page_item.set("Self", f"{xml_content_ref}ToNode")
+        spread.index.set(page_item, "ParentStory", xml_content_ref)
+        spread.index.set(page_item, "Self", f"{xml_content_ref}ToNode")
+        self.index_spread_element(spread, page_item)
 
         # To be a node, a Rectangle must be converted into a TextFrame.
         # There is not simple way to change the tag of a XMLElement so
@@ -1067,22 +1711,19 @@ class IDMLPackage(zipfile.ZipFile):
 
         # TODO : make sure the filename does not exists.
         new_spread_name = increment_filename(self.last_spread.name)
-        new_spread_wc_path = os.path.join(working_copy_path, new_spread_name)
-        shutil.copy2(
-            os.path.join(working_copy_path, self.last_spread.name),
-            new_spread_wc_path
-        )
+        self.working_copy.copy(self.last_spread.name, new_spread_name)
         self._spreads = None  # pylint: disable=attribute-defined-outside-init
         self._spreads_objects = None  # pylint: disable=attribute-defined-outside-init
         self._last_spread = None  # pylint: disable=attribute-defined-outside-init
 
         new_spread = Spread(self, new_spread_name, working_copy_path)
-        new_spread.clear()
-        new_spread.node.set("Self", new_spread.get_node_name_from_xml_name())
-
         self.designmap.add_spread(new_spread)
         self.designmap.synchronize()
 
+        new_spread.clear()
+        new_spread.index.set(new_spread.node, "Self", new_spread.get_node_name_from_xml_name())
+        self.index_spread_element(new_spread, new_spread.node)
+
         # The spread synchronization is done outside.
         return new_spread
 
@@ -1091,10 +1732,11 @@ class IDMLPackage(zipfile.ZipFile):
 
         spread_elements = []
         for spread_object in self.spreads_objects:
-            spread_elements.extend(spread_object.dom.xpath(
-                ".//*%(excluded_tags)s[@ItemLayer='%(layer_id)s']" % {
-                    'excluded_tags': "".join([f"[not(self::{e})]" for e in excluded_tags]),
-                    'layer_id': layer_id}))
+            items, guides = self.layer_usage[spread_object.name]
+            if not items.get(layer_id) and ("Guide" in excluded_tags or not guides.get(layer_id)):
+                continue
+            spread_elements.extend(elt for elt in spread_object.dom.iterdescendants(etree.Element)
+                                   if elt.get("ItemLayer") == layer_id and elt.tag not in excluded_tags)
 
         return spread_elements
 
@@ -1103,7 +1745,7 @@ class IDMLPackage(zipfile.ZipFile):
         return next(filter(lambda s: s.name == name, self.spreads_objects))
 
     def get_spread_object_by_xpath(self, xpath):
-        elt_id = self.xml_structure.xpath(xpath)[0].get("XMLContent")
+        elt_id = self.get_xml_structure_node(xpath).get("XMLContent")
         return self.get_spread_object_by_id(elt_id)
 
     def get_spread_object_by_id(self, elt_id):
@@ -1111,22 +1753,31 @@ class IDMLPackage(zipfile.ZipFile):
 
         Spread element matches Story's one with the ParentStory or the Self attribute value."""
 
-        result = None
+        name = self.spread_ids.get(elt_id)
+        if name is None:
+            return None
+        spread = next((s for s in self.spreads_objects if s.name == name), None)
+        if spread is None or not self._spread_has_element(spread, elt_id):
+            # The spreads have been modified behind spread_ids.
+            self._spread_ids = None  # pylint: disable=attribute-defined-outside-init
+            return self._find_spread_object_by_id(elt_id)
+        return spread
+
+    def _find_spread_object_by_id(self, elt_id):
         for spread in self.spreads_objects:
-            if (
-                spread.get_element_by_id(elt_id, tag="*") is not None or
-                spread.get_element_by_id(elt_id, tag="*", attr="ParentStory") is not None
-            ):
-                result = spread
-            # FIXME: That's ugly. return spread here ?
-            if result:
-                break
-        return result
+            if self._spread_has_element(spread, elt_id):
+                return spread
+        return None
+
+    @staticmethod
+    def _spread_has_element(spread, elt_id):
+        return (spread.get_element_by_id(elt_id, tag="*") is not None or
+                spread.get_element_by_id(elt_id, tag="*", attr="ParentStory") is not None)
 
     def get_spread_elem_by_xpath(self, xpath):
         """Return the spread etree.Element matching the xml_structure's xpath. """
         spread = self.get_spread_object_by_xpath(xpath)
-        elt_id = self.xml_structure.xpath(xpath)[0].get("XMLContent")
+        elt_id = self.get_xml_structure_node(xpath).get("XMLContent")
         elt = spread.get_element_by_id(elt_id, tag="*")
         if elt is None:
             elt = spread.get_element_by_id(elt_id, tag="*", attr="ParentStory")
@@ -1159,7 +1810,7 @@ class IDMLPackage(zipfile.ZipFile):
             self.get_spread_element_layer_id(spread_element.getparent())
 
     def get_story_object_by_xpath(self, xpath):
-        xml_element = self.xml_structure.xpath(xpath)[0]
+        xml_element = self.get_xml_structure_node(xpath)
 
         def get_story_name(xml_element):
             ref = xml_element.get("XMLContent")
@@ -1174,9 +1825,8 @@ class IDMLPackage(zipfile.ZipFile):
 
         # Some XMLElement store a reference which is not a Story.
         # In that case, the Story is the parent's Story.
-        if (story_name not in self.story_ids) and (story_name is not BACKINGSTORY):
-            xpath = self.xml_structure_tree.getpath(xml_element.getparent())
-            story = self.get_story_object_by_xpath(xpath)
+        if (story_name not in self.manifest.story_ids) and (story_name is not BACKINGSTORY):
+            story = self.get_story_object_by_xpath(xml_element.getparent())
         else:
             if story_name == BACKINGSTORY:
                 story = BackingStory(self)
@@ -1190,10 +1840,10 @@ class IDMLPackage(zipfile.ZipFile):
         return story.name if story else None
 
     def get_element_content_id_by_xpath(self, xpath):
-        return self.xml_structure.xpath(xpath)[0].get("XMLContent")
+        return self.get_xml_structure_node(xpath).get("XMLContent")
 
     def get_elem_point_position(self, elem, point_index=0):
-        point = elem.xpath("Properties/PathGeometry/GeometryPathType/PathPointArray/PathPointType")[point_index]
+        point = PATH_POINTS(elem)[point_index]
         x, y = point.get("Anchor").split(" ")
         return Decimal(x), Decimal(y)
 
@@ -1201,11 +1851,86 @@ class IDMLPackage(zipfile.ZipFile):
         item_transform = elem.get("ItemTransform").split(" ")
         return Decimal(item_transform[4]), Decimal(item_transform[5])
 
+    @contextmanager
+    def edit(self):
+        """Run several modifications against a single working copy.
+
+            >>> with idml_package.edit() as doc:
+            ...     doc.import_xml(xml, at="/Root/article[1]")
+            ...     doc.add_note("Check this", "John", at="/Root/article[1]")
+
+        The package is extracted once when entering the block and the methods decorated
+        with `use_working_copy' share that working copy (and the parsed files) instead of
+        extracting and repacking the archive each time. The archive is repacked once when
+        leaving the block and the package is reopened in place.
+        If an exception is raised, the working copy is discarded and the archive is left untouched.
+        Nested sessions are no-ops.
+        """
+        if self.working_copy is not None:
+            yield self
+            return
+
+        open_working_copy(self)
+        try:
+            yield self
+        except BaseException:
+            discard_working_copy(self)
+            raise
+        self._reopen(commit_working_copy(self))
+
+    def clone(self, working_copy_backend=MemoryWorkingCopy):
+        """Return a new package to modify, based on this one used as a template.
+
+            >>> template = IDMLPackage("/path/to/template.idml")
+            >>> for xml in articles:
+            ...     doc = template.clone()
+            ...     doc.import_xml(xml, at="/Root/article[1]")
+            ...     doc.save(f"/path/to/{xml_id}.idml")
+
+        The clone is always in an editing session on an in-memory working copy: its methods
+        modify it in place and save(path) writes it to a new file. Nothing is extracted and the
+        template is parsed once for all its clones: a part is deep-copied from the template
+        the first time a clone reads it. The parts a clone never reads are neither copied
+        nor parsed and they are copied as is from the template archive by save().
+        The template must not be modified or closed while its clones are in use.
+        The clones of a template opened from a file object read their own copy of the archive.
+        """
+        if self.working_copy is not None:
+            raise ValueError("A package being modified cannot be cloned.")
+        file = self.filename if self.filename is not None else io.BytesIO(self.to_bytes())
+        clone = IDMLPackage(file, **dict(self.options, working_copy_backend=working_copy_backend))
+        clone.template = self
+        open_working_copy(clone)
+        return clone
+
+    def _reopen(self, file):
+        """Reopen the (repacked) archive `file' (a path or a file object) in read mode. """
+        zipfile.ZipFile.__init__(self, file, mode="r", compression=zipfile.ZIP_STORED)
+        self._cache = None
+        self.reset_parts()
+        self.init_lazy_references()
+
     def _repack(self, target_path, source_dir=None):
-        """Re-package the working copy into an IDML file at target_path."""
-        source_dir = source_dir or self.working_copy_path
-        if not source_dir:
+        """Re-package the working copy into an IDML file at target_path (a path or a file object).
+
+        Only the dirty parts (see mark_dirty()) and the files added to the working copy
+        are read from it. The other members are copied as is from the original archive,
+        in their original order (`mimetype' must remain the first member).
+        If source_dir is given, every file is read from that directory.
+        """
+        if source_dir is None and self.working_copy is None:
             return
+        self.flush()
+
+        if source_dir is None:
+            namelist = self.namelist()
+        else:
+            namelist = get_directory_namelist(source_dir)
+        archive_namelist = zipfile.ZipFile.namelist(self)
+        archive_names = set(archive_namelist)
+        names = set(namelist)
+        namelist = ([name for name in archive_namelist if name in names] +
+                    [name for name in namelist if name not in archive_names])
 
         # Create a new archive from the extracted one.
         # Ensure we don't open self (which might be in read mode) but a new handle
@@ -1221,35 +1946,76 @@ class IDMLPackage(zipfile.ZipFile):
         # The decorator used IDMLPackage.
         
         with zipfile.ZipFile(target_path, "w", compression=zipfile.ZIP_STORED) as zf:
-            for root, dirs, filenames in os.walk(source_dir):
-                for filename in filenames:
-                    abs_path = os.path.join(root, filename)
-                    arcname = abs_path.replace(source_dir, "")
-                    # Remove leading separator if exists
-                    if arcname.startswith(os.sep):
-                         arcname = arcname[len(os.sep):]
-                    elif arcname.startswith("/"):
-                         arcname = arcname[1:]
-                    
-                    zf.write(abs_path, arcname)
+            for name in namelist:
+                if source_dir is not None:
+                    zf.write(os.path.join(source_dir, name), name)
+                elif name in archive_names and name not in self.dirty_parts:
+                    self._copy_member(zf, name)
+                else:
+                    self.working_copy.write_member(zf, name)
+
+    def _copy_member(self, zf, name):
+        """Copy the archive member `name' into the ZipFile zf without going through the working copy. """
+        info = self.getinfo(name)
+        zinfo = zipfile.ZipInfo(name, date_time=info.date_time)
+        zinfo.compress_type = zipfile.ZIP_STORED
+        zinfo.external_attr = info.external_attr
+        with self.open(info) as src, zf.open(zinfo, mode="w") as dst:
+            shutil.copyfileobj(src, dst)
 
     def save(self, path=None):
         """Save the IDML package.
         
-        If path is provided, save as a new file (Save As). 
+        If path is provided, save as a new file (Save As). It can also be a writable binary
+        file object (an HTTP response, a io.BytesIO...) the archive is streamed into.
         The original file remains identical (unless modifications were already committed).
         If path is None, save changes to the current file (Save).
         """
         if path is None:
+            if self.template is not None:
+                raise ValueError("A clone must be saved to a new path.")
+            if self.filename is None:
+                raise ValueError("A package opened from a file object must be saved to a path or a file object.")
             path = self.filename
         
-        # If we have a working copy (unsaved changes in a temp dir)
-        if self.working_copy_path:
-            self._repack(path)
+        if not isinstance(path, (str, os.PathLike)):
+            if self.working_copy is not None:
+                self._repack(path)
+            else:
+                self._copy_archive(path)
+        # If we have a working copy (unsaved changes)
+        elif self.working_copy is not None:
+            if self.filename is not None and os.path.abspath(path) == os.path.abspath(self.filename):
+                # The original archive is still read by the working copy:
+                # the new one replaces it once complete.
+                with NamedTemporaryFile(dir=os.path.dirname(os.path.abspath(path)),
+                                        suffix=".idml", delete=False) as tmp_package:
+                    self._repack(tmp_package)
+                os.replace(tmp_package.name, path)
+            else:
+                self._repack(path)
         else:
             # If we are not currently in a working copy context (changes already flushed or just opened)
             # We just copy the file if it's a "Save As"
-            if os.path.abspath(path) != os.path.abspath(self.filename):
+            if self.filename is None:
+                with open(path, mode="wb") as fobj:
+                    self._copy_archive(fobj)
+            elif os.path.abspath(path) != os.path.abspath(self.filename):
                 shutil.copy2(self.filename, path)
             # If path == filename, nothing to do as changes are presumably already in the file 
             # (or we are in a clean state)
+
+    def to_bytes(self):
+        """Return the IDML package, with the changes of the working copy if any, as a bytestring. """
+        buf = io.BytesIO()
+        self.save(buf)
+        return buf.getvalue()
+
+    def _copy_archive(self, fobj):
+        """Write the original archive into the file object fobj. """
+        if self.filename is not None:
+            with open(self.filename, mode="rb") as src:
+                shutil.copyfileobj(src, fobj)
+        else:
+            self.fp.seek(0)
+            shutil.copyfileobj(self.fp, fobj)
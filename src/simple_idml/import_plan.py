@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+from simple_idml import SETCONTENT_TAG, IGNORECONTENT_TAG, FORCECONTENT_TAG
+
+# The source attributes changing what import_xml() does, part of the shape of a node.
+FLAG_ATTRS = (SETCONTENT_TAG, IGNORECONTENT_TAG, FORCECONTENT_TAG)
+
+
+class ImportStep():
+    """What import_xml() does for a source node: its destination and the work left per record.
+
+    A skipped node (not matching any destination, see import_xml()) has no element_id. """
+
+    def __init__(self, tag, flags, element_id=None, story_name=None, content_id=None, spread_name=None,
+                 set_attributes=False, set_content=False, move_siblings=False, children=None):
+        self.tag = tag
+        self.flags = flags
+        self.element_id = element_id
+        self.story_name = story_name
+        self.content_id = content_id
+        self.spread_name = spread_name
+        self.set_attributes = set_attributes
+        self.set_content = set_content
+        self.move_siblings = move_siblings
+        self.children = children or []
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} object {self.tag} -> {self.element_id} at {hex(id(self))}>"
+
+    def matches(self, source_node):
+        """True if source_node has the shape of the sample node of the step. """
+        if source_node.tag != self.tag or get_flags(source_node) != self.flags:
+            return False
+        if self.element_id is None:
+            return True
+        if source_node.get("href") == "" or len(source_node) != len(self.children):
+            return False
+        return all(step.matches(child) for step, child in zip(self.children, source_node))
+
+
+class ImportPlan():
+    """The destinations of the import of the XML fragments shaped like a sample, resolved once
+    (see IDMLPackage.compile_import() and IDMLPackage.apply_import()).
+
+    The plan holds the element ids, the story and spread names of the destinations: it applies
+    to the package it is compiled from, as long as its XML structure is not changed, and to the
+    clones of that package. """
+
+    def __init__(self, at, root):
+        self.at = at
+        self.root = root
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} object at {self.at} at {hex(id(self))}>"
+
+    def matches(self, source_node):
+        return self.root.matches(source_node)
+
+
+def get_flags(source_node):
+    return tuple(source_node.get(attr) for attr in FLAG_ATTRS)
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+from lxml import etree
+from simple_idml import IdPkgNS
+
+rx_part_id = re.compile(r"^(?:Stories/Story|Spreads/Spread|MasterSpreads/MasterSpread)_(\w+)\.xml$")
+
+# The kind of the parts named after their id, by directory.
+KINDS_BY_DIRNAME = {
+    "Stories": "Story",
+    "Spreads": "Spread",
+    "MasterSpreads": "MasterSpread",
+}
+
+
+class PackageManifest():
+    """The parts of a package by kind.
+
+    `stories', `spreads' and `master_spreads' map the ids to the part names in the order of their
+    references in designmap.xml, the parts it does not reference following in the order of the
+    archive listing: their keys are sets (`story_id in manifest.stories' does not scan the
+    listing). `resources' maps the kind of the other parts referenced by designmap.xml
+    (`Graphic', `Styles', `BackingStory'...) to their names.
+    The methods adding a part to the working copy register it with add(). """
+
+    def __init__(self, stories=None, spreads=None, master_spreads=None, resources=None):
+        self.stories = stories or {}
+        self.spreads = spreads or {}
+        self.master_spreads = master_spreads or {}
+        self.resources = resources or {}
+
+    def __repr__(self):
+        return (f"<{self.__class__.__name__} object ({len(self.stories)} stories, {len(self.spreads)} spreads)"
+                f" at {hex(id(self))}>")
+
+    @classmethod
+    def build(cls, names, designmap_dom):
+        """The manifest of the parts `names' (the archive listing) referenced by designmap_dom. """
+        names = list(names)
+        listed_names = set(names)
+        references = {}
+        for elt in designmap_dom.iterchildren(f"{{{IdPkgNS}}}*"):
+            if elt.get("src") in listed_names:
+                references.setdefault(elt.get("src"), etree.QName(elt).localname)
+        manifest = cls()
+        for name, kind in references.items():
+            manifest.add(name, kind)
+        for name in names:
+            if name not in references:
+                manifest.add(name)
+        return manifest
+
+    @property
+    def story_ids(self):
+        return self.stories.keys()
+
+    @property
+    def spread_ids(self):
+        return self.spreads.keys()
+
+    def add(self, name, kind=None):
+        """Register the part `name'. Its kind defaults to the one of its directory. """
+        kind = kind or KINDS_BY_DIRNAME.get(os.path.dirname(name))
+        parts = {"Story": self.stories, "Spread": self.spreads, "MasterSpread": self.master_spreads}.get(kind)
+        if parts is None:
+            if kind is not None:
+                self.resources[kind] = name
+            return
+        match = rx_part_id.match(name)
+        if match:
+            parts[match.group(1)] = name
+
+    def as_dict(self):
+        """The maps of the manifest, JSON serializable (see PackageManifest(**d)). """
+        return {"stories": self.stories, "spreads": self.spreads,
+                "master_spreads": self.master_spreads, "resources": self.resources}
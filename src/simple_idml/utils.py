@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 import copy
+import numbers
 import os
 import re
 from lxml import etree
@@ -59,6 +60,48 @@ def increment_xmltag_id(xmltag_id, position="sibling"):
         return "%si1" % xmltag_id
 
 
+def iterparse_records(source):
+    """Parse the XML file `source' (a path or a binary file object) incrementally.
+
+    Yield its root element without children first, once its text is parsed, then each child
+    of the root (a record) once its tail is parsed. A record is removed from the tree when
+    the next one is requested: the whole file is never in memory.
+    """
+    events = etree.iterparse(source, events=("start", "end"), huge_tree=True)
+    _, root = next(events)
+    record = None
+    depth = 0
+    for event, elt in events:
+        if event == "start":
+            depth += 1
+            if depth > 1:
+                continue
+            if record is None:
+                # The text of the root is parsed.
+                yield _get_shallow_copy(root)
+            else:
+                yield record
+                root.remove(record)
+                record = None
+        elif elt is root:
+            break
+        else:
+            depth -= 1
+            if depth == 0:
+                record = elt
+    if record is None:
+        yield _get_shallow_copy(root)
+    else:
+        yield record
+        root.remove(record)
+
+
+def _get_shallow_copy(elt):
+    copy_elt = etree.Element(elt.tag, dict(elt.attrib))
+    copy_elt.text = elt.text
+    return copy_elt
+
+
 def str_is_prefixed(prefix, strng):
     if re.match("^%s.+$" % prefix, strng):
         return True
@@ -103,6 +146,51 @@ def tree_to_etree_dom(tree):
     return dom
 
 
+def data_to_etree_dom(tag, data):
+    """Convert data in a elementTree dom instance with the root `tag'.
+
+    data is nested mappings (a tree is converted by tree_to_etree_dom()):
+
+    data = {
+        "@simpleidml-setcontent": "clear",    # An attribute (True/False are "true"/"false").
+        "#text": "foo",                       # The text.
+        "title": "bar",                       # A child <title>bar</title>.
+        "item": ["a", {"name": "b"}],         # Some children <item>.
+    }
+
+    A string (or a number) is the text of the element, None an empty element. An attribute
+    set to None is omitted. TypeError is raised for the other values (i.e. a list in a list).
+    """
+
+    def _set_node_data(node, data):
+        if isinstance(data, dict):
+            for key, value in data.items():
+                if key.startswith("@"):
+                    if value is not None:
+                        node.set(key[1:], _to_text(value))
+                elif key == "#text":
+                    node.text = _to_text(value)
+                else:
+                    for item in (value if isinstance(value, (list, tuple)) else [value]):
+                        _set_node_data(etree.SubElement(node, key), item)
+        else:
+            node.text = _to_text(data)
+
+    dom = etree.Element(tag)
+    _set_node_data(dom, data)
+    return dom
+
+
+def _to_text(value):
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (str, numbers.Number)):
+        return str(value)
+    raise TypeError(f"Cannot convert {value!r} to XML text.")
+
+
 def etree_dom_to_tree(dom, strip_text=False):
     """A mapping representation of a etree node. """
     return {
@@ -114,6 +202,20 @@ def etree_dom_to_tree(dom, strip_text=False):
     }
 
 
+def strip_blank_text(dom):
+    """Drop the whitespace-only text between the elements of dom, like the `remove_blank_text'
+    option of the lxml parsers, except in <Content> where it is text of the story
+    (i.e. the space of `<Content> <?ACE 7?></Content>'). """
+    for elt in dom.iter(etree.Element):
+        if elt.tag == "Content" or not len(elt):
+            continue
+        if elt.text is not None and not elt.text.strip():
+            elt.text = None
+        for child in elt:
+            if child.tail is not None and not child.tail.strip():
+                child.tail = None
+
+
 def deepcopy_element_as(element, tag):
     new_element = etree.Element(tag, **element.attrib)
     for child in element.iterchildren():
@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import shutil
+import time
+import zipfile
+from tempfile import NamedTemporaryFile
+
+
+class WorkingCopy():
+    """Abstract storage of the files of an IDMLPackage being modified.
+
+    The parts are addressed by their name in the archive (i.e. `Stories/Story_u102.xml').
+    Every write goes through this object so the package knows which parts are dirty
+    and which parsed trees are obsolete.
+
+    In write-behind mode (see IDMLPackage.write_behind) the synchronized parts are only
+    serialized by flush(), which is called before any raw access to such a part and
+    when the package is repacked. """
+    path = None
+
+    def __init__(self, idml_package):
+        self.idml_package = idml_package
+        self._pending = {}
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} object {self.path} at {hex(id(self))}>"
+
+    def namelist(self):
+        raise NotImplementedError
+
+    def exists(self, name):
+        raise NotImplementedError
+
+    def open(self, name):
+        """Return a binary file object opened for reading. """
+        self.flush(name)
+        return self._open(name)
+
+    def read(self, name):
+        with self.open(name) as fobj:
+            return fobj.read()
+
+    def write(self, name, data):
+        """Write (or create) the part `name' with the bytestring data. """
+        self._pending.pop(name, None)
+        self._write(name, data)
+        self._touch(name)
+
+    def store(self, xml_file):
+        """Save the tree of xml_file (an IDMLXMLFile) in its part.
+
+        In write-behind mode the serialization of an existing part is deferred to flush(). """
+        name = xml_file.name
+        if self.idml_package.write_behind and self.exists(name):
+            self._pending[name] = xml_file
+            self._touch(name)
+        else:
+            self.write(name, xml_file.tostring())
+        self.idml_package.parsed_parts[name] = xml_file.dom
+
+    def flush(self, name=None):
+        """Serialize the pending part `name' or all the pending parts (see IDMLPackage.map_parts()). """
+        names = list(self._pending) if name is None else [name]
+        xml_files = {n: self._pending.pop(n) for n in names if n in self._pending}
+        self.idml_package.map_parts(lambda n: self._write(n, xml_files[n].tostring()), xml_files)
+
+    def copy(self, name, new_name):
+        self.flush(name)
+        self._copy(name, new_name)
+        self._touch(new_name)
+
+    def rename(self, name, new_name):
+        self.flush(name)
+        self._rename(name, new_name)
+        self._touch(new_name)
+        self._move_parsed_part(name, new_name)
+
+    def write_member(self, zf, name):
+        """Store the part `name' in the ZipFile zf. """
+        self.flush(name)
+        self._write_member(zf, name)
+
+    def cleanup(self):
+        """Release the resources held by the working copy. """
+        self._pending = {}
+
+    def _open(self, name):
+        raise NotImplementedError
+
+    def _write(self, name, data):
+        raise NotImplementedError
+
+    def _copy(self, name, new_name):
+        with self._open(name) as fobj:
+            self._write(new_name, fobj.read())
+
+    def _rename(self, name, new_name):
+        raise NotImplementedError
+
+    def _write_member(self, zf, name):
+        with self._open(name) as fobj:
+            zf.writestr(zipfile.ZipInfo(name, date_time=time.localtime()[:6]), fobj.read())
+
+    def _touch(self, name):
+        """The part has been written: it is dirty and its parsed tree is obsolete. """
+        self.idml_package.mark_dirty(name)
+        self.idml_package.parsed_parts.pop(name, None)
+
+    def _move_parsed_part(self, name, new_name):
+        dom = self.idml_package.parsed_parts.pop(name, None)
+        if dom is not None:
+            self.idml_package.parsed_parts[new_name] = dom
+
+
+class StoredMember(io.BufferedIOBase):
+    """A read-only file object over a ZIP_STORED member of a memory-mapped archive.
+
+    getbuffer() returns the content as a memoryview of the archive, without copy.
+    The CRC of the member is not checked. """
+
+    def __init__(self, view):
+        super().__init__()
+        self._view = view
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            end = len(self._view)
+        else:
+            end = min(self._pos + size, len(self._view))
+        data = bytes(self._view[self._pos:end])
+        self._pos = end
+        return data
+
+    def getbuffer(self):
+        return self._view
+
+    def close(self):
+        if not self.closed:
+            self._view.release()
+        super().close()
+
+
+class DirectoryWorkingCopy(WorkingCopy):
+    """The package is extracted in a temporary directory. """
+
+    def __init__(self, idml_package):
+        super().__init__(idml_package)
+        self.path = NamedTemporaryFile().name
+        if idml_package.workers:
+            namelist = zipfile.ZipFile.namelist(idml_package)
+            for dirname in {os.path.dirname(name) for name in namelist}:
+                os.makedirs(os.path.join(self.path, dirname), exist_ok=True)
+            idml_package.map_parts(lambda name: idml_package.extract(name, self.path), namelist)
+        else:
+            idml_package.extractall(self.path)
+
+    def namelist(self):
+        return get_directory_namelist(self.path)
+
+    def exists(self, name):
+        return os.path.exists(self._get_path(name))
+
+    def cleanup(self):
+        super().cleanup()
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+
+    def _get_path(self, name):
+        return os.path.join(self.path, name)
+
+    def _open(self, name):
+        return open(self._get_path(name), mode="rb")
+
+    def _write(self, name, data):
+        dirname = os.path.dirname(self._get_path(name))
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        with open(self._get_path(name), mode="wb+") as fobj:
+            fobj.write(data)
+
+    def _copy(self, name, new_name):
+        shutil.copy2(self._get_path(name), self._get_path(new_name))
+
+    def _rename(self, name, new_name):
+        os.rename(self._get_path(name), self._get_path(new_name))
+
+    def _write_member(self, zf, name):
+        zf.write(self._get_path(name), name)
+
+
+class MemoryWorkingCopy(WorkingCopy):
+    """The parts are kept in memory.
+
+    Nothing is extracted: a part is read from the archive until it is written.
+    The path is only a label, there is nothing on the filesystem. """
+
+    def __init__(self, idml_package):
+        super().__init__(idml_package)
+        self.path = f"memory://{hex(id(self))}"
+        self._namelist = zipfile.ZipFile.namelist(idml_package)
+        self._names = set(self._namelist)
+        self._files = {}
+
+    def namelist(self):
+        return list(self._namelist)
+
+    def exists(self, name):
+        return name in self._names
+
+    def cleanup(self):
+        super().cleanup()
+        self._files = {}
+
+    def _open(self, name):
+        if name in self._files:
+            return io.BytesIO(self._files[name])
+        if name not in self._names:
+            raise KeyError(f"There is no item named '{name}' in the working copy")
+        return self.idml_package.open_member(name)
+
+    def _rename(self, name, new_name):
+        """The renamed part keeps its position in the namelist. """
+        with self._open(name) as fobj:
+            data = fobj.read()
+        self._namelist[self._namelist.index(name)] = new_name
+        self._names.remove(name)
+        self._names.add(new_name)
+        self._files.pop(name, None)
+        self._files[new_name] = data
+
+    def _write(self, name, data):
+        if name not in self._names:
+            self._namelist.append(name)
+            self._names.add(name)
+        self._files[name] = data
+
+
+def get_directory_namelist(directory):
+    """The files of directory named as members of an archive. """
+    namelist = []
+    for root, dirs, filenames in os.walk(directory):
+        rel_root = root.replace(directory, "")[1:]
+        for filename in filenames:
+            namelist.append("%(rel_root)s%(sep)s%(filename)s" % {
+                'rel_root': rel_root,
+                'sep': rel_root and "/" or "",
+                'filename': filename
+            })
+    return namelist
+
+
+WORKING_COPY_BACKENDS = {
+    "directory": DirectoryWorkingCopy,
+    "memory": MemoryWorkingCopy,
+}
+
+
+def get_working_copy_backend(backend):
+    """`backend' is either a key of WORKING_COPY_BACKENDS or a WorkingCopy subclass. """
+    if isinstance(backend, str):
+        try:
+            return WORKING_COPY_BACKENDS[backend]
+        except KeyError as exc:
+            raise ValueError(f"Unknown working copy backend '{backend}'."
+                             f" Choices are: {', '.join(WORKING_COPY_BACKENDS)}.") from exc
+    return backend
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+
+"""Compiled XPath expressions of the frequent queries on the XML files of a package.
+
+An expression is compiled once and called with the context element. The parameterised ones
+take their values as XPath variables, i.e.: XMLATTRIBUTE_BY_NAME(element, name="href"). """
+
+from lxml import etree
+
+# Story and XMLElement content.
+CHARACTER_STYLE_RANGES = etree.XPath("./CharacterStyleRange")
+LOCAL_CHARACTER_STYLE_RANGES = etree.XPath("./ParagraphStyleRange/CharacterStyleRange | ./CharacterStyleRange")
+CONTENT_NODES = etree.XPath("./ParagraphStyleRange/CharacterStyleRange/Content | "
+                            "./CharacterStyleRange/Content | "
+                            "./XMLElement/CharacterStyleRange/Content | "
+                            "./Content")
+CONTENT_AND_XMLELEMENT_NODES = etree.XPath("./ParagraphStyleRange/CharacterStyleRange/Content | "
+                                           "./CharacterStyleRange/Content | "
+                                           "./ParagraphStyleRange/CharacterStyleRange/XMLElement | "
+                                           "./CharacterStyleRange/XMLElement | "
+                                           "./ParagraphStyleRange/XMLElement | "
+                                           "./XMLElement | "
+                                           "./Content")
+XMLATTRIBUTES = etree.XPath("./XMLAttribute")
+XMLATTRIBUTE_BY_NAME = etree.XPath("./XMLAttribute[@Name=$name]")
+
+# Page items.
+ITEMS_ON_LAYER = etree.XPath(".//*[not(self::Guide)][@ItemLayer=$layer_id]")
+GUIDES_ON_LAYER = etree.XPath(".//Guide[@ItemLayer=$layer_id]")
+PATH_POINTS = etree.XPath("Properties/PathGeometry/GeometryPathType/PathPointArray/PathPointType")
+
+# Designmap, styles and tags.
+LAYER_BY_NAME = etree.XPath(".//Layer[@Name=$name]")
+LAYER_BY_ID = etree.XPath(".//Layer[@Self=$layer_id]")
+CHARACTER_STYLE_BY_ID = etree.XPath(".//CharacterStyle[@Self=$style_id]")
+XMLTAG_BY_ID = etree.XPath("//XMLTag[@Self=$tag_id]")
@@ -0,0 +1,776 @@
+# -*- coding: utf-8 -*-
+
+import copy
+import gc
+import io
+import os
+import shutil
+import sys
+import tempfile
+import zipfile
+from lxml import etree
+from simple_idml import IdPkgNS
+from simple_idml.components import Story, Style, XMLElement
+from simple_idml.idml import IDMLPackage
+from simple_idml.test import SimpleTestCase
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+IDMLFILES_DIR = os.path.join(CURRENT_DIR, "..", "test")
+
+ARTICLE_1 = "<article><Story><title>T1</title><subtitle>S1</subtitle></Story><content>C1</content></article>"
+CONTENT_2 = "<content>C2</content>"
+MAPPED_CONTENT = "<content>Hello <b>bold <i>it</i></b> world <i>x</i> end</content>"
+MAPPED_STYLES = {
+    "content": ("editoeditoeditoeditoeditoeditoeditoeditoeditoeditoeditoeditoeditoedito"
+                "blocnotesblocnotesblocnotesblocnotesblocnotesblocnotesblocnotes"
+                "CharacterStyle/$ID/[No character style]"),
+    "b": "CharacterStyle/Bold",
+    "i": "CharacterStyle/Italic",
+}
+
+
+class IDMLPackageTestCase(SimpleTestCase):
+    """The packages are opened from copies of the test documents. """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def get_package(self, filename, **options):
+        """Open a copy of the test document `filename' (or of the file at that path). """
+        path = os.path.join(self.tmp_dir, f"{len(os.listdir(self.tmp_dir))}_{os.path.basename(filename)}")
+        shutil.copy(os.path.join(IDMLFILES_DIR, filename), path)
+        return IDMLPackage(path, **options)
+
+    def get_mapped_document(self):
+        """The path of a copy of 2page.idml mapping the tags `content', `b' and `i' to character styles. """
+        path = os.path.join(self.tmp_dir, "2page_mapped.idml")
+        mapping = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                   '<idPkg:Mapping xmlns:idPkg="http://ns.adobe.com/AdobeInDesign/idml/1.0/packaging" DOMVersion="7.5">' +
+                   "".join(f'<XMLImportMap Self="m{tag}" MarkupTag="XMLTag/{tag}" MappedStyle="{style}"/>'
+                           for tag, style in MAPPED_STYLES.items()) +
+                   '</idPkg:Mapping>')
+        with zipfile.ZipFile(os.path.join(IDMLFILES_DIR, "2page.idml")) as source, \
+                zipfile.ZipFile(path, "w") as target:
+            for name in source.namelist():
+                content = source.read(name)
+                if name == "Resources/Styles.xml":
+                    styles = etree.fromstring(content)
+                    group = styles.find("RootCharacterStyleGroup")
+                    etree.SubElement(group, "CharacterStyle", Self=MAPPED_STYLES["b"], Name="Bold", FontStyle="Bold")
+                    etree.SubElement(group, "CharacterStyle", Self=MAPPED_STYLES["i"], Name="Italic",
+                                     FontStyle="Italic", PointSize="9")
+                    content = etree.tostring(styles, xml_declaration=True, encoding="UTF-8", standalone=True)
+                target.writestr(name, content)
+            target.writestr("XML/Mapping.xml", mapping)
+        return path
+
+    def import_xml_sequentially(self, filename, fragments):
+        """The export_xml() of the test document after one import_xml() call per (xml, at) fragment. """
+        idml_package = self.get_package(filename)
+        for xml, at in fragments:
+            idml_package = idml_package.import_xml(xml, at)
+        with idml_package:
+            return idml_package.export_xml()
+
+    def assertArchivesEqual(self, first, second):
+        """The archives (paths or file objects) have the same members, in the same order, with the same bytes. """
+        with zipfile.ZipFile(first) as first_zip, zipfile.ZipFile(second) as second_zip:
+            self.assertEqual(first_zip.namelist(), second_zip.namelist())
+            for name in first_zip.namelist():
+                self.assertEqual(first_zip.read(name), second_zip.read(name), name)
+
+
+class EditTestCase(IDMLPackageTestCase):
+    fragments = [
+        (ARTICLE_1, "/Root/page[1]/article[1]"),
+        (CONTENT_2, "/Root/page[1]/article[1]/content[1]"),
+    ]
+
+    def _test_edit(self, working_copy_backend):
+        idml_package = self.get_package("12page.idml", working_copy_backend=working_copy_backend)
+        with idml_package.edit():
+            for xml, at in self.fragments:
+                idml_package.import_xml(xml, at)
+        with IDMLPackage(idml_package.filename) as saved_package:
+            self.assertXMLEqual(saved_package.export_xml(),
+                                self.import_xml_sequentially("12page.idml", self.fragments))
+        idml_package.close()
+
+    def test_edit_directory(self):
+        self._test_edit("directory")
+
+    def test_edit_memory(self):
+        self._test_edit("memory")
+
+    def test_edit_exception(self):
+        idml_package = self.get_package("12page.idml")
+        with open(idml_package.filename, "rb") as fobj:
+            original = fobj.read()
+        with self.assertRaises(IndexError):
+            with idml_package.edit():
+                idml_package.import_xml(ARTICLE_1, "/Root/page[1]/article[1]")
+                idml_package.import_xml(CONTENT_2, "/Root/page[99]/article[1]/content[1]")
+        with open(idml_package.filename, "rb") as fobj:
+            self.assertEqual(fobj.read(), original)
+        idml_package.close()
+
+
+class WriteBehindTestCase(IDMLPackageTestCase):
+    def edit(self, idml_package):
+        idml_package = idml_package.import_xml(CONTENT_2, "/Root/page[1]/article[1]/content[1]")
+        idml_package = idml_package.import_xml("<article><title><title>T1</title></title><subtitle>S1</subtitle></article>",
+                                               "/Root/page[1]/article[1]")
+        idml_package = idml_package.remove_content("/Root/page[2]")
+        return idml_package.prefix("FOO")
+
+    def _test_write_behind(self, working_copy_backend, session):
+        paths = []
+        for write_behind in (False, True):
+            idml_package = self.get_package("2page.idml", working_copy_backend=working_copy_backend,
+                                            write_behind=write_behind)
+            if session:
+                with idml_package.edit():
+                    self.edit(idml_package)
+            else:
+                idml_package = self.edit(idml_package)
+            paths.append(idml_package.filename)
+            idml_package.close()
+        self.assertArchivesEqual(*paths)
+
+    def test_write_behind_directory(self):
+        self._test_write_behind("directory", session=False)
+        self._test_write_behind("directory", session=True)
+
+    def test_write_behind_memory(self):
+        self._test_write_behind("memory", session=False)
+        self._test_write_behind("memory", session=True)
+
+
+class ElementIndexTestCase(IDMLPackageTestCase):
+    def assertIndexedElements(self, story):
+        for elt in story.dom.iter("XMLElement"):
+            found = story.get_element_by_id(elt.get("Self"))
+            self.assertIs(found.element, story.dom.xpath(f"//XMLElement[@Self='{elt.get('Self')}']")[0])
+
+    def test_get_element_by_id(self):
+        with self.get_package("2page_complex.idml") as idml_package:
+            for name in idml_package.stories:
+                self.assertIndexedElements(Story(idml_package, name))
+
+    def test_get_element_by_id_after_import(self):
+        idml_package = self.get_package("2page.idml")
+        with idml_package.edit():
+            idml_package.import_xml("<Root><page><article><title><title>in</title></title></article></page></Root>",
+                                    "/Root")
+            for name in idml_package.stories:
+                self.assertIndexedElements(Story(idml_package, name, idml_package.working_copy_path))
+        idml_package.close()
+
+    def assertSpreadIds(self, idml_package, spread_ids):
+        # The index is kept between the calls of a session, and equals a new one.
+        self.assertIs(idml_package._spread_ids, spread_ids)
+        idml_package._spread_ids = None
+        self.assertEqual(idml_package.spread_ids, spread_ids)
+        idml_package._spread_ids = spread_ids
+
+    def test_spread_ids(self):
+        idml_package = self.get_package("2page.idml", working_copy_backend="memory").prefix("A")
+        other_package = self.get_package("12page.idml", working_copy_backend="memory").prefix("B")
+        with idml_package.edit():
+            spread_ids = idml_package.spread_ids
+            idml_package.add_page_from_idml(other_package, 1, "/Root", "/Root/page[1]")
+            self.assertSpreadIds(idml_package, spread_ids)
+            self.assertEqual(len(idml_package.pages), 3)
+            idml_package.remove_content("/Root/page[1]")
+            self.assertSpreadIds(idml_package, spread_ids)
+        other_package.close()
+        idml_package.close()
+
+
+class ManifestTestCase(IDMLPackageTestCase):
+    def test_prefix(self):
+        idml_package = self.get_package("2page.idml")
+        with IDMLPackage(idml_package.filename) as original_package:
+            xml = original_package.export_xml()
+        idml_package = idml_package.prefix("my_pre")
+        with idml_package:
+            self.assertTrue(all(story_id.startswith("my_pre") for story_id in idml_package.story_ids))
+            self.assertXMLEqual(idml_package.export_xml(), xml)
+
+    def assertDesignmapOrder(self, idml_package):
+        references = [elt.get("src") for elt in idml_package.designmap.dom.iterchildren(f"{{{IdPkgNS}}}*")]
+        self.assertEqual(idml_package.spreads, [name for name in references if name in idml_package.spreads])
+        self.assertEqual(idml_package.stories, [name for name in references if name in idml_package.stories])
+
+    def test_order(self):
+        # The renamed parts are listed in another order by the working copies and the new archive.
+        spreads = {}
+        for working_copy_backend in ("directory", "memory"):
+            idml_package = self.get_package("2page.idml", working_copy_backend=working_copy_backend)
+            with idml_package.edit():
+                idml_package.prefix("my_pre")
+                self.assertDesignmapOrder(idml_package)
+                spreads[working_copy_backend] = idml_package.spreads
+            with IDMLPackage(idml_package.filename) as saved_package:
+                self.assertDesignmapOrder(saved_package)
+                self.assertEqual(saved_package.spreads, spreads[working_copy_backend])
+            idml_package.close()
+        self.assertEqual(spreads["directory"], spreads["memory"])
+
+
+class ImportXMLManyTestCase(IDMLPackageTestCase):
+    def _test_import_xml_many(self, filename, fragments):
+        idml_package = self.get_package(filename).import_xml_many(fragments)
+        with idml_package:
+            self.assertXMLEqual(idml_package.export_xml(), self.import_xml_sequentially(filename, fragments))
+
+    def test_import_xml_many(self):
+        self._test_import_xml_many("12page.idml", [
+            (ARTICLE_1, "/Root/page[1]/article[1]"),
+            ("<title>Courrier</title>", "/Root/page[3]/title[1]"),
+            (CONTENT_2, "/Root/page[1]/article[1]/content[1]"),
+        ])
+
+    def test_import_xml_many_overlapping_destinations(self):
+        # The second destination is inside the first one: the last import wins.
+        fragments = [
+            ("<article><title>A</title><subtitle>Sub</subtitle></article>", "/Root/page[1]/article[1]"),
+            ("<title>B</title>", "/Root/page[1]/article[1]/title[1]"),
+        ]
+        self._test_import_xml_many("2page.idml", fragments)
+        with self.get_package("2page.idml").import_xml_many(fragments) as idml_package:
+            self.assertIn("<title>B<", idml_package.export_xml())
+
+
+class ImportXMLFileTestCase(IDMLPackageTestCase):
+    def _test_import_xml_file(self, filename, xml, at):
+        path = os.path.join(self.tmp_dir, "records.xml")
+        with open(path, "w", encoding="utf-8") as fobj:
+            fobj.write(xml)
+        idml_package = self.get_package(filename).import_xml_file(path, at)
+        with idml_package:
+            self.assertXMLEqual(idml_package.export_xml(), self.import_xml_sequentially(filename, [(xml, at)]))
+
+    def test_import_xml_file(self):
+        self._test_import_xml_file("12page.idml", ARTICLE_1, "/Root/page[1]/article[1]")
+
+    def test_import_xml_file_skipped_records(self):
+        self._test_import_xml_file("2page.idml", "<article><title>A</title><content>C</content></article>",
+                                   "/Root/page[1]/article[1]")
+
+    def test_import_xml_file_new_nodes(self):
+        self._test_import_xml_file(self.get_mapped_document(), MAPPED_CONTENT, "/Root/page[1]/article[1]/content[1]")
+
+
+class XMLStructureTestCase(IDMLPackageTestCase):
+    def test_get_xml_structure_node_path(self):
+        with self.get_package("12page.idml") as idml_package:
+            node = idml_package.get_xml_structure_node("/Root/page[2]")
+            # Another node is now at that path.
+            node.addprevious(etree.Element("page"))
+            self.assertIsNot(idml_package.get_xml_structure_node("/Root/page[2]"), node)
+            self.assertIs(idml_package.get_xml_structure_node("/Root/page[3]"), node)
+            # There is no node at that path anymore.
+            last_path = f"/Root/page[{len(idml_package.xml_structure)}]"
+            last_node = idml_package.get_xml_structure_node(last_path)
+            last_node.getparent().remove(last_node)
+            self.assertRaises(IndexError, idml_package.get_xml_structure_node, last_path)
+
+    def get_recursive_xml_structure(self, idml_package):
+        """The XML structure discovered recursively from the parsed stories. """
+        def append_childs(source_node, destination_node):
+            for elt in source_node.iterchildren():
+                if not elt.tag == "XMLElement":
+                    append_childs(elt, destination_node)
+                if elt.get("Self") == source_node.get("Self") or not elt.get("MarkupTag"):
+                    continue
+                elt = XMLElement(elt)
+                new_destination_node = elt.to_xml_structure_element()
+                destination_node.append(new_destination_node)
+                if elt.get("XMLContent"):
+                    story_name = f"Stories/Story_{elt.get('XMLContent')}.xml"
+                    if story_name not in idml_package.namelist():
+                        continue
+                    new_source_node = Story(idml_package, story_name).get_element_by_id(elt.get("Self"))
+                    if new_source_node is not None:
+                        append_childs(new_source_node, new_destination_node)
+                else:
+                    append_childs(elt, new_destination_node)
+
+        source_node = idml_package.backing_story.get_root()
+        structure = source_node.to_xml_structure_element()
+        append_childs(source_node, structure)
+        return structure
+
+    def test_xml_structure_discovery(self):
+        for filename in ("2page.idml", "2page_complex.idml", "12page.idml", "blank.idml"):
+            with self.get_package(filename) as idml_package:
+                expected = etree.tostring(self.get_recursive_xml_structure(idml_package))
+            for stream_xml_structure in (False, True):
+                for workers in (None, 4):
+                    with self.get_package(filename, stream_xml_structure=stream_xml_structure,
+                                          workers=workers) as idml_package:
+                        self.assertEqual(etree.tostring(idml_package.xml_structure), expected,
+                                         (filename, stream_xml_structure, workers))
+
+    def test_get_skeleton(self):
+        def get_xml_elements(root):
+            return [(elt.attrib, [parent.get("Self") for parent in elt.iterancestors("XMLElement")])
+                    for elt in root.iter("XMLElement")]
+
+        for filename in ("2page.idml", "2page_complex.idml", "12page.idml"):
+            with self.get_package(filename) as idml_package:
+                for name in idml_package.stories:
+                    skeleton = Story(idml_package, name).get_skeleton()
+                    self.assertIsNone(idml_package.get_parsed_part(name))
+                    self.assertEqual(get_xml_elements(skeleton), get_xml_elements(Story(idml_package, name).dom))
+
+
+class WorkersTestCase(IDMLPackageTestCase):
+    def test_open_member_threads(self):
+        with self.get_package("12page.idml") as idml_package:
+            names = idml_package.stories
+            expected = [zipfile.ZipFile.read(idml_package, name) for name in names]
+
+            def read(name):
+                with idml_package.open_member(name) as fobj:
+                    return fobj.read()
+            self.assertEqual(idml_package.workers, None)
+            idml_package.workers = 8
+            self.assertEqual(idml_package.map_parts(read, names), expected)
+
+    def test_pool(self):
+        idml_package = self.get_package("12page.idml", workers=4)
+        names = idml_package.stories
+        self.assertEqual(idml_package.map_parts(len, names), [len(name) for name in names])
+        executor = idml_package._executor
+        self.assertIsNotNone(executor)
+        idml_package.map_parts(len, names)
+        self.assertIs(idml_package._executor, executor)
+        idml_package.close()
+        self.assertIsNone(idml_package._executor)
+        self.assertTrue(executor._shutdown)
+
+    def test_prefix_workers(self):
+        xml = {}
+        for workers in (None, 4):
+            with self.get_package("2page.idml", workers=workers).prefix("FOO") as idml_package:
+                xml[workers] = idml_package.export_xml()
+        self.assertXMLEqual(xml[4], xml[None])
+
+
+class BindTestCase(IDMLPackageTestCase):
+    def _test_bind(self, filename, data, xml, at):
+        with self.get_package(filename).bind(data, at) as idml_package:
+            self.assertXMLEqual(idml_package.export_xml(), self.import_xml_sequentially(filename, [(xml, at)]))
+
+    def test_bind(self):
+        self._test_bind("2page.idml",
+                        {"page": {"article": {"title": {"title": "in"}, "subtitle": "Sub", "content": "Body"}}},
+                        "<Root><page><article><title><title>in</title></title>"
+                        "<subtitle>Sub</subtitle><content>Body</content></article></page></Root>",
+                        "/Root")
+        self._test_bind("12page.idml",
+                        {"Story": {"title": "T1", "subtitle": "S1"}, "content": "C1"},
+                        ARTICLE_1,
+                        "/Root/page[1]/article[1]")
+
+    def test_bind_flags(self):
+        self._test_bind("2page.idml",
+                        {"page": {"article": {"@simpleidml-setcontent": "clear", "title": "X"}}},
+                        '<Root><page><article simpleidml-setcontent="clear"><title>X</title></article></page></Root>',
+                        "/Root")
+        self._test_bind("12page.idml",
+                        {"@simpleidml-ignorecontent": True,
+                         "Story": {"title": "T1", "subtitle": {"@simpleidml-forcecontent": True, "#text": "S1"}}},
+                        '<article simpleidml-ignorecontent="true"><Story><title>T1</title>'
+                        '<subtitle simpleidml-forcecontent="true">S1</subtitle></Story></article>',
+                        "/Root/page[1]/article[1]")
+
+    def test_bind_tree(self):
+        with self.get_package("2page_complex.idml") as idml_package:
+            tree = idml_package.export_as_tree()
+            xml = idml_package.export_xml()
+        with self.get_package("2page_complex.idml").bind(tree, "/Root", tree=True) as idml_package:
+            self.assertXMLEqual(idml_package.export_xml(), xml)
+
+
+class ImportPlanTestCase(IDMLPackageTestCase):
+    at = "/Root/page[1]/article[1]"
+    sample = "<article><Story><title>T</title><subtitle>S</subtitle></Story><content>C</content></article>"
+    records = [f"<article><Story><title>T{i}</title><subtitle>S{i}</subtitle></Story><content>C{i}</content></article>"
+               for i in range(3)] + [
+        # Not shaped like the sample: imported by import_xml().
+        "<article><Story><title>odd</title></Story></article>",
+        '<article simpleidml-ignorecontent="true"><Story><title>T</title>'
+        '<subtitle simpleidml-forcecontent="true">F</subtitle></Story><content>C</content></article>',
+    ]
+
+    def test_apply_import(self):
+        idml_package = self.get_package("12page.idml")
+        with idml_package.edit():
+            plan = idml_package.compile_import(self.sample, self.at)
+            self.assertTrue(plan.matches(idml_package._parse_xml_fragment(self.records[0])))
+            self.assertFalse(plan.matches(idml_package._parse_xml_fragment(self.records[3])))
+            for record in self.records:
+                idml_package.apply_import(plan, record)
+        with IDMLPackage(idml_package.filename) as saved_package:
+            self.assertXMLEqual(saved_package.export_xml(),
+                                self.import_xml_sequentially("12page.idml", [(r, self.at) for r in self.records]))
+        idml_package.close()
+
+    def test_apply_import_clones(self):
+        with self.get_package("12page.idml", working_copy_backend="memory") as template:
+            plan = template.compile_import(self.sample, self.at)
+            for record in self.records:
+                clone = template.clone()
+                clone.apply_import(plan, record)
+                self.assertXMLEqual(clone.export_xml(),
+                                    self.import_xml_sequentially("12page.idml", [(record, self.at)]))
+                clone.close()
+
+    def test_compile_import_new_nodes(self):
+        with self.get_package(self.get_mapped_document()) as idml_package:
+            self.assertRaises(ValueError, idml_package.compile_import,
+                              "<content>Hello <b>bold</b></content>", "/Root/page[1]/article[1]/content[1]")
+            self.assertRaises(ValueError, idml_package.compile_import,
+                              '<article simpleidml-setcontent="clear"><title>X</title></article>',
+                              "/Root/page[1]/article[1]")
+
+
+class StyleRangeTestCase(IDMLPackageTestCase):
+    at = "/Root/page[1]/article[1]/content[1]"
+    xml = "<content>" + "".join(f"w{i} <b>bold <i>it{i}</i></b> and <i>x</i> " for i in range(3)) + "end</content>"
+
+    def get_story_xml(self, idml_package):
+        return idml_package.get_story_object_by_xpath(self.at).tostring()
+
+    def test_nested_style_ranges(self):
+        # The style ranges merged once per chain of styles give those of the same imports made one by one.
+        fragments = [(self.xml, self.at), (MAPPED_CONTENT, self.at)]
+        sequential_package = self.get_package(self.get_mapped_document())
+        for xml, at in fragments:
+            sequential_package = sequential_package.import_xml(xml, at)
+        idml_package = self.get_package(self.get_mapped_document())
+        with idml_package.edit():
+            for xml, at in fragments:
+                idml_package.import_xml(xml, at)
+            self.assertTrue(idml_package._style_range_prototypes)
+        with sequential_package, IDMLPackage(idml_package.filename) as saved_package:
+            self.assertXMLEqual(saved_package.export_xml(), sequential_package.export_xml())
+            self.assertXMLEqual(self.get_story_xml(saved_package).decode("utf-8"),
+                                self.get_story_xml(sequential_package).decode("utf-8"))
+        idml_package.close()
+
+    def test_style_change(self):
+        idml_package = self.get_package(self.get_mapped_document())
+        with idml_package.edit():
+            idml_package.import_xml(self.xml, self.at)
+            self.assertTrue(idml_package._style_range_prototypes)
+            idml_package.mark_dirty(Style.name)
+            self.assertEqual(idml_package._style_range_prototypes, {})
+        idml_package.close()
+
+
+class SaveTestCase(IDMLPackageTestCase):
+    fragments = [(CONTENT_2, "/Root/page[1]/article[1]/content[1]")]
+
+    def test_save_file_object(self):
+        idml_package = self.get_package("2page.idml")
+        with open(idml_package.filename, "rb") as fobj:
+            original = fobj.read()
+        buf = io.BytesIO()
+        idml_package.save(buf)
+        self.assertEqual(buf.getvalue(), original)
+        self.assertEqual(idml_package.to_bytes(), original)
+
+        with idml_package.edit():
+            idml_package.import_xml(*self.fragments[0])
+            buf = io.BytesIO()
+            idml_package.save(buf)
+            data = idml_package.to_bytes()
+        self.assertEqual(buf.getvalue(), data)
+        self.assertArchivesEqual(io.BytesIO(data), idml_package.filename)
+        with IDMLPackage(io.BytesIO(data)) as saved_package:
+            self.assertXMLEqual(saved_package.export_xml(), self.import_xml_sequentially("2page.idml", self.fragments))
+        idml_package.close()
+
+    def test_file_object_package(self):
+        with open(os.path.join(IDMLFILES_DIR, "2page.idml"), "rb") as fobj:
+            original = fobj.read()
+        idml_package = IDMLPackage(io.BytesIO(original))
+        self.assertEqual(idml_package.to_bytes(), original)
+        with self.assertRaises(ValueError):
+            idml_package.save()
+
+        idml_package = idml_package.import_xml(*self.fragments[0])
+        self.assertIsNone(idml_package.filename)
+        expected = self.import_xml_sequentially("2page.idml", self.fragments)
+        self.assertXMLEqual(idml_package.export_xml(), expected)
+        path = os.path.join(self.tmp_dir, "saved.idml")
+        idml_package.save(path)
+        with open(path, "rb") as fobj:
+            self.assertEqual(fobj.read(), idml_package.to_bytes())
+
+        with idml_package.edit():
+            idml_package.remove_content("/Root/page[2]")
+        self.assertIsNone(idml_package.filename)
+        expected_package = self.get_package("2page.idml").import_xml(*self.fragments[0])
+        with expected_package.remove_content("/Root/page[2]") as expected_package, \
+                IDMLPackage(io.BytesIO(idml_package.to_bytes())) as saved_package:
+            self.assertXMLEqual(saved_package.export_xml(), expected_package.export_xml())
+        idml_package.close()
+
+
+class LayersTestCase(IDMLPackageTestCase):
+    def get_layered_document(self):
+        """The path of a copy of 2page.idml with 4 layers: items and a guide on `L2', a guide on `L3',
+        nothing on `L4'. """
+        path = os.path.join(self.tmp_dir, "2page_layers.idml")
+        with zipfile.ZipFile(os.path.join(IDMLFILES_DIR, "2page.idml")) as source, \
+                zipfile.ZipFile(path, "w") as target:
+            spread_names = [name for name in source.namelist() if name.startswith("Spreads/")]
+            for name in source.namelist():
+                content = source.read(name)
+                if name == "designmap.xml":
+                    designmap = etree.fromstring(content)
+                    layer = designmap.find("Layer")
+                    for layer_id in ("L4", "L3", "L2"):
+                        new_layer = copy.deepcopy(layer)
+                        new_layer.set("Self", layer_id)
+                        new_layer.set("Name", f"Layer {layer_id}")
+                        layer.addnext(new_layer)
+                    content = etree.tostring(designmap.getroottree(), xml_declaration=True, encoding="UTF-8",
+                                             standalone=True)
+                elif name in spread_names:
+                    spread = etree.fromstring(content)
+                    node = spread.find("Spread")
+                    if name == spread_names[0]:
+                        node.find("TextFrame").set("ItemLayer", "L2")
+                        etree.SubElement(node, "Guide", Self="g3", ItemLayer="L3")
+                    etree.SubElement(node, "Guide", Self=f"g{len(node)}", ItemLayer="L2")
+                    content = etree.tostring(spread.getroottree(), xml_declaration=True, encoding="UTF-8",
+                                             standalone=True)
+                target.writestr(name, content)
+        return path
+
+    def get_parts(self, path):
+        """The layer ids of the designmap and the spreads, parsed, of the archive at path. """
+        with zipfile.ZipFile(path) as archive:
+            designmap = etree.fromstring(archive.read("designmap.xml"))
+            spreads = {name: etree.fromstring(archive.read(name))
+                       for name in archive.namelist() if name.startswith("Spreads/")}
+        return [layer.get("Self") for layer in designmap.findall("Layer")], spreads
+
+    def assertSpreadsEqual(self, spreads, expected):
+        self.assertEqual(set(spreads), set(expected))
+        for name, spread in spreads.items():
+            self.assertEqual(etree.tostring(spread), etree.tostring(expected[name]), name)
+
+    def test_remove_orphan_layers(self):
+        path = self.get_layered_document()
+        layer_ids, expected = self.get_parts(path)
+        # An orphan layer has no items in the spreads; its guides are removed with it.
+        orphans = [layer_id for layer_id in layer_ids
+                   if not any(spread.xpath(f".//*[not(self::Guide)][@ItemLayer='{layer_id}']")
+                              for spread in expected.values())]
+        self.assertEqual(orphans, ["L3", "L4"])
+        for spread in expected.values():
+            for guide in spread.xpath(".//Guide[@ItemLayer='L3']"):
+                guide.getparent().remove(guide)
+
+        idml_package = IDMLPackage(path).remove_orphan_layers()
+        idml_package.close()
+        new_layer_ids, spreads = self.get_parts(path)
+        self.assertEqual(new_layer_ids, [layer_id for layer_id in layer_ids if layer_id not in orphans])
+        self.assertSpreadsEqual(spreads, expected)
+
+    def test_merge_layers(self):
+        path = self.get_layered_document()
+        layer_ids, expected = self.get_parts(path)
+        for spread in expected.values():
+            for elt in spread.xpath(".//*[@ItemLayer]"):
+                elt.set("ItemLayer", layer_ids[0])
+
+        idml_package = IDMLPackage(path).merge_layers()
+        idml_package.close()
+        new_layer_ids, spreads = self.get_parts(path)
+        self.assertEqual(new_layer_ids, layer_ids[:1])
+        self.assertSpreadsEqual(spreads, expected)
+
+    def test_get_spread_elements_by_layer(self):
+        with IDMLPackage(self.get_layered_document()) as idml_package:
+            for layer_id in ("L2", "L3", "L4"):
+                for excluded_tags in ([], ["Guide"]):
+                    expected = []
+                    for spread in idml_package.spreads_objects:
+                        expected.extend(spread.dom.xpath(
+                            ".//*" + "".join(f"[not(self::{tag})]" for tag in excluded_tags) +
+                            f"[@ItemLayer='{layer_id}']"))
+                    self.assertEqual(idml_package.get_spread_elements_by_layer(layer_id=layer_id,
+                                                                               excluded_tags=excluded_tags),
+                                     expected)
+
+
+class CacheTestCase(IDMLPackageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache_dir = os.path.join(self.tmp_dir, "cache")
+
+    def get_structure(self, path):
+        """The XML structure of the package at path, opened without and with the cache, and the parsed parts. """
+        with IDMLPackage(path) as idml_package:
+            expected = etree.tostring(idml_package.xml_structure)
+        with IDMLPackage(path, cache_dir=self.cache_dir) as idml_package:
+            return expected, etree.tostring(idml_package.xml_structure), set(idml_package.parsed_parts)
+
+    def test_reuse(self):
+        path = self.get_package("12page.idml").filename
+        expected, structure, parsed_parts = self.get_structure(path)
+        self.assertEqual(structure, expected)
+        self.assertTrue(parsed_parts)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+        # A second open reads the structure from the cache, without parsing the stories.
+        expected, structure, parsed_parts = self.get_structure(path)
+        self.assertEqual(structure, expected)
+        self.assertEqual(parsed_parts, set())
+
+    def test_changed_archive(self):
+        idml_package = self.get_package("12page.idml")
+        self.get_structure(idml_package.filename)
+        idml_package = idml_package.import_xml(ARTICLE_1, "/Root/page[1]/article[1]")
+        idml_package.close()
+        expected, structure, parsed_parts = self.get_structure(idml_package.filename)
+        self.assertEqual(structure, expected)
+        self.assertTrue(parsed_parts)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+
+    def test_corrupt_file(self):
+        path = self.get_package("12page.idml").filename
+        self.get_structure(path)
+        cache_path = os.path.join(self.cache_dir, os.listdir(self.cache_dir)[0])
+        for content in ('{"xml_structure": "<Ro', "[]"):
+            with open(cache_path, "w", encoding="utf-8") as fobj:
+                fobj.write(content)
+            expected, structure, parsed_parts = self.get_structure(path)
+            self.assertEqual(structure, expected)
+            self.assertTrue(parsed_parts)
+            # The file is rebuilt.
+            self.assertEqual(self.get_structure(path)[2], set())
+
+
+class CloneTestCase(IDMLPackageTestCase):
+    fragments = [(ARTICLE_1, "/Root/page[1]/article[1]")]
+
+    def _test_clone(self, template):
+        expected = self.import_xml_sequentially("12page.idml", self.fragments)
+        for _ in range(2):
+            clone = template.clone()
+            for xml, at in self.fragments:
+                clone.import_xml(xml, at)
+            self.assertXMLEqual(clone.export_xml(), expected)
+            with IDMLPackage(io.BytesIO(clone.to_bytes())) as saved_package:
+                self.assertXMLEqual(saved_package.export_xml(), expected)
+            clone.close()
+
+    def test_clone(self):
+        with self.get_package("12page.idml") as template:
+            self._test_clone(template)
+
+    def test_clone_file_object(self):
+        with open(os.path.join(IDMLFILES_DIR, "12page.idml"), "rb") as fobj:
+            template = IDMLPackage(io.BytesIO(fobj.read()))
+        with template:
+            self._test_clone(template)
+
+
+class OpenTestCase(IDMLPackageTestCase):
+    def test_open_bad_file(self):
+        path = os.path.join(self.tmp_dir, "bad.idml")
+        with open(path, "wb") as fobj:
+            fobj.write(b"not an archive")
+        # The exceptions raised while the package is collected.
+        unraisable = []
+        unraisablehook, sys.unraisablehook = sys.unraisablehook, unraisable.append
+        try:
+            self.assertRaises(FileNotFoundError, IDMLPackage, os.path.join(self.tmp_dir, "missing.idml"))
+            self.assertRaises(zipfile.BadZipFile, IDMLPackage, path)
+            gc.collect()
+        finally:
+            sys.unraisablehook = unraisablehook
+        self.assertEqual(unraisable, [])
+
+
+class SerializationTestCase(IDMLPackageTestCase):
+    def get_ace_document(self):
+        """The path of a copy of 2page.idml and the name of its story with `<Content> <?ACE 7?></Content>'. """
+        path = os.path.join(self.tmp_dir, "2page_ace.idml")
+        with zipfile.ZipFile(os.path.join(IDMLFILES_DIR, "2page.idml")) as source, \
+                zipfile.ZipFile(path, "w") as target:
+            story_name = None
+            for name in source.namelist():
+                content = source.read(name)
+                if story_name is None and name.startswith("Stories/"):
+                    story_name = name
+                    story = etree.fromstring(content)
+                    content_node = story.find(".//Content")
+                    content_node.text = " "
+                    content_node.append(etree.ProcessingInstruction("ACE", "7"))
+                    content = etree.tostring(story, xml_declaration=True, encoding="UTF-8", standalone=True)
+                target.writestr(name, content)
+        return path, story_name
+
+    def get_saved_parts(self, path, story_name, **options):
+        """designmap.xml and the story story_name of the document at path rewritten with the options. """
+        with self.get_package(path, **options).prefix("FOO") as idml_package:
+            return (zipfile.ZipFile.read(idml_package, "designmap.xml"),
+                    zipfile.ZipFile.read(idml_package, story_name.replace("Story_", "Story_FOO")))
+
+    def test_default(self):
+        path, story_name = self.get_ace_document()
+        designmap, story = self.get_saved_parts(path, story_name)
+        self.assertTrue(designmap.startswith(b"<?xml version='1.0' encoding='UTF-8' standalone='yes'?>\n"
+                                             b"<?aid style=\"50\" type=\"document\""))
+        self.assertTrue(story.startswith(b"<?xml version='1.0' encoding='UTF-8' standalone='yes'?>\n"))
+        self.assertIn(b"\n\t", story)
+        self.assertIn(b"<Content> <?ACE 7?></Content>", story)
+
+    def test_compact(self):
+        path, story_name = self.get_ace_document()
+        designmap, story = self.get_saved_parts(path, story_name, pretty_print=False, remove_blank_text=True,
+                                                xml_declaration=False)
+        self.assertTrue(designmap.startswith(b"<?aid style=\"50\" type=\"document\""))
+        self.assertTrue(story.startswith(b"<idPkg:Story "))
+        self.assertNotIn(b">\n", story)
+        self.assertNotIn(b">\t", story)
+        self.assertIn(b"<Content> <?ACE 7?></Content>", story)
+
+    def test_empty_content(self):
+        # The cleared and empty <Content> are written <Content/> as when the stories are parsed again.
+        idml_package = self.get_package("12page.idml")
+        for xml, at in [(ARTICLE_1, "/Root/page[1]/article[1]"),
+                        ('<page><article simpleidml-setcontent="clear"><title>X</title></article></page>',
+                         "/Root/page[3]")]:
+            idml_package = idml_package.import_xml(xml, at)
+        with idml_package:
+            for name in idml_package.stories:
+                story = zipfile.ZipFile.read(idml_package, name)
+                self.assertNotIn(b"<Content></Content>", story)
+                self.assertEqual(story, Story(idml_package, name).tostring())
+
+    def test_remove_blank_text(self):
+        path, story_name = self.get_ace_document()
+        with self.get_package(path, remove_blank_text=True) as idml_package:
+            story = Story(idml_package, story_name)
+            content_node = story.dom.find(".//Content")
+            self.assertEqual(content_node.text, " ")
+            self.assertEqual(len(content_node), 1)
+            self.assertEqual(story.dom.text, None)
+            self.assertEqual([elt.tail for elt in story.dom.iter(etree.Element) if elt.tail and not elt.tail.strip()],
+                             [])
+        with self.get_package(path, remove_blank_text=True) as idml_package:
+            skeleton = Story(idml_package, story_name).get_skeleton()
+            self.assertEqual([elt.tail for elt in skeleton.iter() if elt.tail and not elt.tail.strip()], [])
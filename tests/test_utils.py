@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+
+from lxml import etree
+from simple_idml.test import SimpleTestCase
+from simple_idml.utils import data_to_etree_dom
+
+
+class DataToEtreeDomTestCase(SimpleTestCase):
+    def assertDataXML(self, data, xml):
+        self.assertXMLEqual(etree.tostring(data_to_etree_dom("root", data)).decode("utf-8"), xml)
+
+    def test_data_to_etree_dom(self):
+        self.assertDataXML({"@simpleidml-setcontent": "clear", "@simpleidml-forcecontent": True,
+                            "#text": "foo", "title": "bar", "item": ["a", {"name": "b"}, 3]},
+                           '<root simpleidml-setcontent="clear" simpleidml-forcecontent="true">foo'
+                           '<title>bar</title><item>a</item><item><name>b</name></item><item>3</item></root>')
+
+    def test_tree_keys(self):
+        # `tag' and `content' are children like any other key.
+        self.assertDataXML({"content": "body", "tag": "k"}, "<root><content>body</content><tag>k</tag></root>")
+
+    def test_none(self):
+        self.assertDataXML(None, "<root/>")
+        self.assertDataXML({"#text": None}, "<root/>")
+        self.assertDataXML({"@a": None, "b": None}, "<root><b/></root>")
+
+    def test_unsupported(self):
+        self.assertRaises(TypeError, data_to_etree_dom, "root", {"b": [["x", "y"]]})
+        self.assertRaises(TypeError, data_to_etree_dom, "root", {"@a": ["x"]})
+        self.assertRaises(TypeError, data_to_etree_dom, "root", {"#text": object()})